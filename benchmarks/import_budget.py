@@ -0,0 +1,56 @@
+"""Check that the app starts without importing its heavy dependencies.
+
+Imports main in a fresh interpreter, as ``python main.py`` would before showing the window, and exits with status 1
+if any of HEAVY_MODULES was imported or the import took longer than ``--budget-ms``. Those modules must be imported
+inside the functions that need them, after the window is shown.
+
+    python benchmarks/import_budget.py
+"""
+
+import argparse
+import json
+import pathlib
+import subprocess
+import sys
+
+
+app_path = pathlib.Path(__file__).resolve().parents[1] / "pythonapp"
+HEAVY_MODULES = ("pandas", "geopandas", "shapely", "yaml", "slugify", "rapidfuzz", "thefuzz", "PIL")
+IMPORT_SCRIPT = """
+import json, sys, time
+start = time.perf_counter()
+import main
+seconds = time.perf_counter() - start
+print(json.dumps({"import_ms": seconds * 1000, "modules": sorted(sys.modules)}))
+"""
+
+
+def measure():
+    """Time to import main in a fresh interpreter, in milliseconds, and the heavy modules it imported."""
+    output = subprocess.run(
+        [sys.executable, "-c", IMPORT_SCRIPT],
+        cwd=app_path, capture_output=True, text=True, check=True,
+    ).stdout
+    result = json.loads(output)
+    loaded = {name.partition(".")[0] for name in result["modules"]}
+    return result["import_ms"], sorted(loaded & set(HEAVY_MODULES))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--budget-ms", type=float, default=250.0, help="Allowed time to import main.")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    runs = [measure() for _ in range(args.repeat)]
+    import_ms = min(ms for ms, _ in runs)
+    heavy = runs[0][1]
+    print(json.dumps({"import_ms": import_ms, "heavy_modules": heavy}, indent=2))
+    failures = []
+    if heavy:
+        failures.append(f"main imports heavy modules eagerly: {', '.join(heavy)}")
+    if import_ms > args.budget_ms:
+        failures.append(f"importing main took {import_ms:.0f} ms, over the budget of {args.budget_ms:.0f} ms")
+    for failure in failures:
+        print(f"FAILED {failure}", file=sys.stderr)
+    sys.exit(1 if failures else 0)
@@ -0,0 +1,138 @@
+"""Load test of the quiz server, pythonapp/server.py, with thousands of simulated players on localhost.
+
+Starts a server on a free port, unless ``--port`` names a running one, and connects ``--clients`` players. Once all
+are connected they play at once: each guesses ``--guesses`` countries in a random order, getting most of them right,
+now and then withdrawing a guess and verifying every few guesses. Every request waits for its reply before the next is
+sent. The throughput of guesses and the latency of each guess round trip are printed as JSON.
+
+    python benchmarks/quiz_load.py
+    python benchmarks/quiz_load.py --clients 5000 --guesses 50
+    python benchmarks/quiz_load.py --port 8765
+"""
+
+import argparse
+import asyncio
+import json
+import pathlib
+import random
+import signal
+import subprocess
+import sys
+import time
+
+root_path = pathlib.Path(__file__).resolve().parents[1]
+sys.path.append(str(root_path / "pythonapp"))
+
+import server
+
+
+class Player:
+    def __init__(self, countries, rng, accuracy=0.8, undo_rate=0.05, verify_every=10):
+        self.countries = countries
+        self.rng = rng
+        self.accuracy = accuracy
+        self.undo_rate = undo_rate
+        self.verify_every = verify_every
+        self.reader = self.writer = None
+        self.latencies = []
+        self.errors = 0
+
+    async def connect(self, host, port):
+        self.reader, self.writer = await asyncio.open_connection(host, port)
+
+    async def request(self, request):
+        self.writer.write(json.dumps(request).encode() + b"\n")
+        await self.writer.drain()
+        reply = json.loads(await self.reader.readline())
+        if "error" in reply:
+            self.errors += 1
+        return reply
+
+    async def play(self, n_guesses):
+        try:
+            for k, country in enumerate(self.rng.sample(self.countries, min(n_guesses, len(self.countries))), 1):
+                name = country if self.rng.random() < self.accuracy else self.rng.choice(self.countries)
+                sent = time.perf_counter()
+                await self.request({"op": "guess", "country": country, "name": name})
+                self.latencies.append(time.perf_counter() - sent)
+                if self.rng.random() < self.undo_rate:
+                    await self.request({"op": "undo", "country": country})
+                if k % self.verify_every == 0:
+                    await self.request({"op": "verify"})
+            await self.request({"op": "verify"})
+        finally:
+            self.writer.close()
+            await self.writer.wait_closed()
+
+
+def percentile(values, q):
+    """The q-th percentile of sorted values, by the nearest rank."""
+    return values[min(len(values) - 1, int(q / 100 * len(values)))]
+
+
+async def run(host, port, n_clients, n_guesses, seed=0):
+    probe = Player([], None)
+    await probe.connect(host, port)
+    countries = (await probe.request({"op": "countries"}))["countries"]
+    probe.writer.close()
+
+    rng = random.Random(seed)
+    players = [Player(countries, random.Random(rng.random())) for _ in range(n_clients)]
+    started = time.perf_counter()
+    await asyncio.gather(*(player.connect(host, port) for player in players))
+    connect_seconds = time.perf_counter() - started
+    started = time.perf_counter()
+    await asyncio.gather(*(player.play(n_guesses) for player in players))
+    seconds = time.perf_counter() - started
+
+    latencies = sorted(latency * 1000 for player in players for latency in player.latencies)
+    return {
+        "clients": n_clients,
+        "connect_s": round(connect_seconds, 3),
+        "guesses": len(latencies),
+        "errors": sum(player.errors for player in players),
+        "seconds": round(seconds, 3),
+        "guesses_per_s": round(len(latencies) / seconds, 1),
+        "guess_p50_ms": round(percentile(latencies, 50), 3),
+        "guess_p99_ms": round(percentile(latencies, 99), 3),
+        "guess_max_ms": round(latencies[-1], 3),
+    }
+
+
+def start_server(args):
+    """Run the server in its own process on a free port, returning the process and the port."""
+    command = [sys.executable, str(root_path / "pythonapp" / "server.py"), "--host", args.host, "--port", "0"]
+    if args.server_profile:
+        command += ["--profile", args.server_profile]
+    process = subprocess.Popen(command, stdout=subprocess.PIPE, text=True)
+    line = process.stdout.readline()
+    if not line.startswith("Serving on "):
+        process.kill()
+        raise RuntimeError(f"Server did not start: {line!r}")
+    return process, int(line.rsplit(":", 1)[1])
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, help="Port of a running server. By default one is started.")
+    parser.add_argument("--clients", type=int, default=2000, help="Players connected at once.")
+    parser.add_argument("--guesses", type=int, default=20, help="Guesses made by each player.")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--server-profile", metavar="PATH",
+                        help="Write the profile of the started server to PATH, see pythonapp/profiling.py.")
+    args = parser.parse_args()
+
+    server.raise_open_file_limit()
+    process = None
+    port = args.port
+    if port is None:
+        process, port = start_server(args)
+    try:
+        results = asyncio.run(run(args.host, port, args.clients, args.guesses, args.seed))
+    finally:
+        if process is not None:
+            # Interrupt rather than kill, so the server writes its profile.
+            process.send_signal(signal.SIGINT)
+            process.wait()
+    print(json.dumps(results, indent=2))
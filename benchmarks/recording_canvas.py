@@ -0,0 +1,290 @@
+"""Stand-ins for the Tk widgets so the benchmarks run without a display.
+
+RecordingCanvas implements the part of the tk.Canvas API used by the app and counts every call and the vertices it
+touches, giving deterministic numbers alongside the timings.
+"""
+
+import collections
+import itertools
+
+import numpy as np
+
+from fuzzy_match import FuzzyMatcher
+from tkk_plus import ZOOM_STEP_LIMITS, FuzzyAutoComplete, ZoomFrame
+
+# Tk's values of the colour names in resources/style_schema.yaml.
+X11_COLOURS = {"black": "#000000", "white": "#ffffff", "grey": "#bebebe", "gray": "#bebebe", "green": "#00ff00"}
+
+
+class RecordingCanvas:
+    def __init__(self, width=1000, height=600):
+        self.width = width
+        self.height = height
+        self.calls = collections.Counter()
+        self.vertices_touched = 0
+        self._ids = itertools.count(1)
+        self._coords = {}
+        self._tags = {}
+        self._options = {}
+        self._stack = []
+        self._bindings = {}
+        self._pending = {}
+        self._after_ids = itertools.count(1)
+        self._view = np.array((0.0, 0.0))
+        self._mark = np.array((0.0, 0.0))
+
+    def _record(self, name):
+        self.calls[name] += 1
+
+    def _find(self, tag_or_id):
+        if isinstance(tag_or_id, int) or (isinstance(tag_or_id, str) and tag_or_id.isdigit()):
+            i = int(tag_or_id)
+            return [i] if i in self._coords else []
+        if tag_or_id == "all":
+            return list(self._stack)
+        return [i for i in self._stack if tag_or_id in self._tags[i]]
+
+    # Items.
+    def create_polygon(self, *coords, **options):
+        self._record("create_polygon")
+        flat = np.asarray(coords[0] if len(coords) == 1 else coords, dtype=float).reshape(-1, 2)
+        i = next(self._ids)
+        self._coords[i] = flat
+        tags = options.pop("tags", ())
+        self._tags[i] = {tags} if isinstance(tags, str) else set(tags)
+        self._options[i] = options
+        self._stack.append(i)
+        self.vertices_touched += len(flat)
+        return i
+
+    def create_image(self, x, y, **options):
+        self._record("create_image")
+        i = next(self._ids)
+        self._coords[i] = np.array(((x, y),), dtype=float)
+        tags = options.pop("tags", ())
+        self._tags[i] = {tags} if isinstance(tags, str) else set(tags)
+        self._options[i] = options
+        self._stack.append(i)
+        return i
+
+    def coords(self, tag_or_id, *coords):
+        self._record("coords")
+        items = self._find(tag_or_id)
+        if coords:
+            flat = np.asarray(coords[0] if len(coords) == 1 else coords, dtype=float).reshape(-1, 2)
+            for i in items:
+                self._coords[i] = flat
+                self.vertices_touched += len(flat)
+            return None
+        return self._coords[items[0]].ravel().tolist() if items else []
+
+    def itemconfigure(self, tag_or_id, **options):
+        self._record("itemconfigure")
+        for i in self._find(tag_or_id):
+            self._options[i].update(options)
+
+    itemconfig = itemconfigure
+
+    def itemcget(self, tag_or_id, option):
+        items = self._find(tag_or_id)
+        return self._options[items[0]].get(option, "") if items else ""
+
+    def delete(self, *tags_or_ids):
+        self._record("delete")
+        for tag_or_id in tags_or_ids:
+            for i in self._find(tag_or_id):
+                del self._coords[i], self._tags[i], self._options[i]
+                self._stack.remove(i)
+
+    def scale(self, tag_or_id, x, y, x_scale, y_scale):
+        self._record("scale")
+        anchor = np.array((x, y), dtype=float)
+        for i in self._find(tag_or_id):
+            self._coords[i] = anchor + (self._coords[i] - anchor) * (x_scale, y_scale)
+            self.vertices_touched += len(self._coords[i])
+
+    def move(self, tag_or_id, dx, dy):
+        self._record("move")
+        for i in self._find(tag_or_id):
+            self._coords[i] = self._coords[i] + (dx, dy)
+
+    def tag_lower(self, tag_or_id, below=None):
+        self._record("tag_lower")
+        items = self._find(tag_or_id)
+        rest = [i for i in self._stack if i not in set(items)]
+        position = 0
+        if below is not None:
+            below_items = set(self._find(below))
+            position = next((k for k, i in enumerate(rest) if i in below_items), len(rest))
+        self._stack = rest[:position] + items + rest[position:]
+
+    lower = tag_lower
+
+    def tag_raise(self, tag_or_id, above=None):
+        self._record("tag_raise")
+        items = self._find(tag_or_id)
+        rest = [i for i in self._stack if i not in set(items)]
+        position = len(rest)
+        if above is not None:
+            above_items = set(self._find(above))
+            position = max((k + 1 for k, i in enumerate(rest) if i in above_items), default=len(rest))
+        self._stack = rest[:position] + items + rest[position:]
+
+    def find_all(self):
+        return tuple(self._stack)
+
+    def bbox(self, tag_or_id):
+        items = self._find(tag_or_id)
+        if not items:
+            return None
+        coords = np.concatenate([self._coords[i] for i in items])
+        return (*coords.min(axis=0).tolist(), *coords.max(axis=0).tolist())
+
+    # Bindings and events.
+    def bind(self, sequence=None, func=None, add=None):
+        if sequence is None:
+            return tuple(self._bindings)
+        self._record("bind")
+        self._bindings.setdefault(sequence, []).append(func)
+
+    def tag_bind(self, tag_or_id, sequence, func, add=None):
+        self._record("tag_bind")
+
+    def after(self, ms, func=None, *args):
+        self._record("after")
+        identifier = f"after#{next(self._after_ids)}"
+        self._pending[identifier] = (func, args)
+        return identifier
+
+    def after_idle(self, func, *args):
+        self._record("after_idle")
+        identifier = f"after#{next(self._after_ids)}"
+        self._pending[identifier] = (func, args)
+        return identifier
+
+    def after_cancel(self, identifier):
+        self._pending.pop(identifier, None)
+
+    def update(self):
+        """Run the scheduled callbacks, as Tk would when the event loop is idle. Delays are ignored."""
+        while self._pending:
+            identifier = next(iter(self._pending))
+            func, args = self._pending.pop(identifier)
+            if func is not None:
+                func(*args)
+
+    update_idletasks = update
+
+    # View.
+    def configure(self, **options):
+        self._record("configure")
+
+    config = configure
+
+    def winfo_width(self):
+        return self.width
+
+    def winfo_height(self):
+        return self.height
+
+    def winfo_rgb(self, colour):
+        """16-bit (r, g, b) of a "#rrggbb" colour or of an X11 colour name used by the style schema."""
+        colour = X11_COLOURS.get(colour, colour)
+        return tuple(int(colour[k:k + 2], 16) * 257 for k in (1, 3, 5))
+
+    def canvasx(self, x):
+        return x + self._view[0]
+
+    def canvasy(self, y):
+        return y + self._view[1]
+
+    def scan_mark(self, x, y):
+        self._mark = np.array((x, y), dtype=float)
+
+    def scan_dragto(self, x, y, gain=10):
+        self._view = self._view - (np.array((x, y)) - self._mark) * gain
+        self._mark = np.array((x, y), dtype=float)
+
+    def xview(self, *args):
+        return (0.0, 1.0)
+
+    def yview(self, *args):
+        return (0.0, 1.0)
+
+    def focus_set(self):
+        pass
+
+
+class Event:
+    def __init__(self, x=0, y=0, num=0, delta=0):
+        self.x = x
+        self.y = y
+        self.num = num
+        self.delta = delta
+
+
+class Variable:
+    def __init__(self, value=""):
+        self.value = value
+
+    def get(self):
+        return self.value
+
+    def set(self, value):
+        self.value = value
+
+
+class HeadlessZoomFrame(ZoomFrame):
+    """ZoomFrame driving a RecordingCanvas, without creating any Tk widgets."""
+    def __init__(self, canvas):
+        self.canvas = canvas
+        self.imscale = 1.0
+        self.zoom_step = 0
+        self.zoom_step_limits = ZOOM_STEP_LIMITS
+        self._target_step = 0
+        self._pending_zoom = (1.0, np.zeros(2))
+        self._zoom_id = None
+        self.origin = np.array((0.0, 0.0))
+        self.imageid = None
+        self.delta = 0.75
+        self.zoom_callbacks = []
+        self.view_callbacks = []
+        self.extent = None
+
+
+class HeadlessAutoComplete(FuzzyAutoComplete):
+    """FuzzyAutoComplete without a Tk entry. Scheduled rankings run on ``canvas.update()``."""
+    def __init__(self, canvas, values, max_choices=20, debounce_ms=50):
+        self._canvas = canvas
+        self.entry_variable = Variable()
+        self.max_choices = max_choices
+        self.debounce_ms = debounce_ms
+        self._pending_rank = None
+        self._state = "normal"
+        self._matcher = FuzzyMatcher(values)
+        self._index = 0
+        self.typed_text = ""
+        self._ranked_text = ""
+
+    def __getitem__(self, key):
+        return self._state
+
+    def __setitem__(self, key, value):
+        self._state = value
+
+    def after(self, ms, func=None, *args):
+        return self._canvas.after(ms, func, *args)
+
+    def after_cancel(self, identifier):
+        self._canvas.after_cancel(identifier)
+
+    def icursor(self, index):
+        pass
+
+    def focus_set(self):
+        pass
+
+    def type(self, text):
+        """Set the entry text and raise the key release, as typing a key would."""
+        self.entry_variable.set(text)
+        self.autocomplete(Event())
@@ -0,0 +1,319 @@
+"""Benchmarks of map construction, autocomplete, zoom (vector and raster), country state changes and hovering.
+
+Runs headless on RecordingCanvas by default, or on a real tk.Canvas with ``--tk`` (e.g. under ``xvfb-run``). The
+results are printed as JSON and compared with the stored baseline: any metric more than ``--threshold`` above its
+baseline is reported as a regression and the script exits with status 1. Timings (``_s`` and ``_ms`` metrics) must
+also be slower by more than ``--min-delta-ms``, so that noise in sub-millisecond timings is not reported. Every metric
+is lower-is-better.
+
+    python benchmarks/run.py
+    python benchmarks/run.py --update-baseline
+    xvfb-run python benchmarks/run.py --tk
+"""
+
+import argparse
+import json
+import pathlib
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+root_path = pathlib.Path(__file__).resolve().parents[1]
+sys.path.append(str(root_path / "pythonapp"))
+
+import game
+import main
+from geometry_cache import GeometryCache
+from recording_canvas import Event, HeadlessAutoComplete, HeadlessZoomFrame, RecordingCanvas
+from world_map import CountryState, WorldMap
+
+
+baseline_path = pathlib.Path(__file__).resolve().parent / "baseline.json"
+BINDINGS = [("<Enter>", lambda name: None), ("<Leave>", lambda name: None),
+            ("<ButtonRelease-1>", lambda name: None), ("<Double-Button-1>", lambda name: None)]
+
+
+class Harness:
+    """Creates canvases and zoom frames, either headless or on a real Tk display."""
+    def __init__(self, use_tk):
+        self.use_tk = use_tk
+        self.root = None
+        if use_tk:
+            import tkinter as tk
+            self.root = tk.Tk()
+            self.root.geometry("1000x600")
+
+    def zoom_frame(self):
+        if not self.use_tk:
+            return HeadlessZoomFrame(RecordingCanvas())
+        import tkk_plus
+        for child in self.root.winfo_children():
+            child.destroy()
+        frame = tkk_plus.ZoomFrame(self.root)
+        frame.pack(fill="both", expand=True)
+        self.root.update()
+        return frame
+
+    def photo_image(self):
+        """Converts tile images for the canvas. Headless the PIL image itself stands in for the PhotoImage."""
+        return None if self.use_tk else (lambda image: image)
+
+    def canvas_calls(self, canvas):
+        return dict(canvas.calls) if isinstance(canvas, RecordingCanvas) else {}
+
+
+def read_inputs():
+    _, country_schema, styles = main.load_resources()
+    return country_schema, styles
+
+
+def load_geometry(cache_dir=main.cache_path):
+    """The geometry cache of the app's resources, built in ``cache_dir`` if missing."""
+    return GeometryCache.load(cache_dir, main.region_path, main.country_schema_path, topology_path=main.topology_path)
+
+
+def build_map(harness, geometry, country_schema, styles, raster=False, bindings=BINDINGS):
+    frame = harness.zoom_frame()
+    world_map = WorldMap(
+        frame.canvas, geometry, country_schema, styles, bindings,
+        raster=raster, photo_image=harness.photo_image() if raster else None,
+    )
+    frame.zoom_callbacks.append(world_map.set_zoom)
+    frame.view_callbacks.append(world_map.update_visible)
+    frame.set_extent(world_map.extent)
+    frame.canvas.update()
+    return frame, world_map
+
+
+def bench_map_build(harness, country_schema, styles):
+    with tempfile.TemporaryDirectory() as cache_dir:
+        start = time.perf_counter()
+        geometry = load_geometry(cache_dir)
+        frame, _ = build_map(harness, geometry, country_schema, styles)
+        cold = time.perf_counter() - start
+
+        start = time.perf_counter()
+        geometry = load_geometry(cache_dir)
+        frame, _ = build_map(harness, geometry, country_schema, styles)
+        warm = time.perf_counter() - start
+    return {
+        "cold_build_s": cold,
+        "warm_build_s": warm,
+        "canvas_items": len(frame.canvas.find_all()),
+    }
+
+
+def typing_traces(country_schema, n_traces=60, seed=0):
+    """Realistic typing of country names: one key at a time, with the occasional typo corrected by backspace."""
+    rng = random.Random(seed)
+    names = sorted({name for names in country_schema["names"] for name in names})
+    traces = []
+    for name in rng.sample(names, min(n_traces, len(names))):
+        trace = []
+        for i in range(1, len(name) + 1):
+            if rng.random() < 0.1:
+                trace.append(name[:i - 1] + rng.choice("abcdefghijklmnopqrstuvwxyz"))
+                trace.append(name[:i - 1])
+            trace.append(name[:i])
+        traces.append((name, trace))
+    return traces
+
+
+def bench_autocomplete(country_schema):
+    canvas = RecordingCanvas()
+    names = sorted({name for names in country_schema["names"] for name in names})
+    entry = HeadlessAutoComplete(canvas, names)
+    latencies = []
+    for name, trace in typing_traces(country_schema):
+        for text in trace:
+            start = time.perf_counter()
+            entry.type(text)
+            # Rank as soon as the key is released, the worst case of the debouncing.
+            canvas.update()
+            latencies.append(time.perf_counter() - start)
+        entry.remove_choice(name)
+        entry.reset_text()
+    latencies_ms = np.array(latencies) * 1000
+    return {
+        "keystrokes": len(latencies),
+        "keystroke_mean_ms": float(latencies_ms.mean()),
+        "keystroke_p99_ms": float(np.percentile(latencies_ms, 99)),
+    }
+
+
+def bench_zoom(harness, geometry, country_schema, styles, notches=8, raster=False):
+    frame, _ = build_map(harness, geometry, country_schema, styles, raster)
+    canvas = frame.canvas
+    centre = (canvas.winfo_width() // 2, canvas.winfo_height() // 2)
+    per_level = {}
+    for num in [4] * notches + [5] * (2 * notches) + [4] * notches:
+        level = f"wheel_at_{frame.imscale:.2f}_ms"
+        start = time.perf_counter()
+        frame.wheel(Event(*centre, num=num))
+        canvas.update()
+        per_level.setdefault(level, []).append((time.perf_counter() - start) * 1000)
+    results = {level: statistics.mean(latencies) for level, latencies in sorted(per_level.items())}
+    results["wheel_mean_ms"] = statistics.mean(latency for latencies in per_level.values() for latency in latencies)
+    for call, count in harness.canvas_calls(canvas).items():
+        results[f"canvas_{call}_calls"] = count
+    if isinstance(canvas, RecordingCanvas):
+        results["vertices_touched"] = canvas.vertices_touched
+    # A fast scroll: a burst of notches within one frame, zooming out and back in.
+    bursts = []
+    for num in (5, 4, 4, 5):
+        start = time.perf_counter()
+        for _ in range(notches):
+            frame.wheel(Event(*centre, num=num))
+        canvas.update()
+        bursts.append((time.perf_counter() - start) * 1000)
+    results[f"burst_of_{notches}_ms"] = statistics.mean(bursts)
+    return results
+
+
+def bench_state_churn(harness, geometry, country_schema, styles):
+    frame, world_map = build_map(harness, geometry, country_schema, styles)
+    canvas = frame.canvas
+    calls_before = dict(harness.canvas_calls(canvas))
+    start = time.perf_counter()
+    for country in world_map.countries.values():
+        for state in CountryState:
+            country.state = state
+    canvas.update()
+    results = {"state_churn_s": time.perf_counter() - start}
+    for call, count in harness.canvas_calls(canvas).items():
+        if count - calls_before.get(call, 0):
+            results[f"canvas_{call}_calls"] = count - calls_before.get(call, 0)
+    return results
+
+
+def bench_hover(harness, geometry, country_schema, styles, n_rows=10, events_per_row=2000, events_per_frame=16):
+    """Sweep the cursor across the map row by row, with motion events arriving faster than frames.
+
+    There are enough events for the sweep to take tens of milliseconds, well above the noise of the timer.
+    """
+    changes = []
+    bindings = [("<Enter>", changes.append), ("<Leave>", changes.append)]
+    frame, world_map = build_map(harness, geometry, country_schema, styles, bindings=bindings)
+    canvas = frame.canvas
+    hit_tests = 0
+    find = world_map.hover.find
+
+    def counting_find(x, y):
+        nonlocal hit_tests
+        hit_tests += 1
+        return find(x, y)
+
+    world_map.hover.find = counting_find
+    width, height = canvas.winfo_width(), canvas.winfo_height()
+    start = time.perf_counter()
+    for row in range(n_rows):
+        y = height * (row + 0.5) / n_rows
+        for k in range(events_per_row):
+            world_map.hover.motion(Event(width * k / events_per_row, y))
+            if k % events_per_frame == events_per_frame - 1:
+                canvas.update()
+    canvas.update()
+    return {
+        "sweep_s": time.perf_counter() - start,
+        "hit_tests": hit_tests,
+        "hover_changes": len(changes),
+    }
+
+
+def game_scripts(country_schema, n_games=2000, seed=0):
+    """Scripted games: rounds of guesses, mostly correct, some withdrawn, each round verified."""
+    rng = random.Random(seed)
+    schema = game.GameSchema.from_country_schema(country_schema)
+    session = game.GameSession(schema)
+    valid = list(country_schema.index[~country_schema["disputed"]])
+    scripts = []
+    for _ in range(n_games):
+        actions = []
+        remaining = rng.sample(valid, len(valid))
+        while remaining:
+            batch, remaining = remaining[:25], remaining[25:]
+            for country in batch:
+                actions.append(("guess", country, country if rng.random() < 0.8 else rng.choice(valid)))
+                if rng.random() < 0.05:
+                    actions.append(("undo", country))
+            actions.append(("verify",))
+        scripts.append(session.encode_script(actions))
+    return schema, scripts
+
+
+def bench_game_replay(country_schema):
+    schema, scripts = game_scripts(country_schema)
+    start = time.perf_counter()
+    game.replay(schema, scripts)
+    return {"replay_per_game_ms": (time.perf_counter() - start) * 1000 / len(scripts)}
+
+
+def run(harness, repeat):
+    country_schema, styles = read_inputs()
+    geometry = load_geometry()
+    benchmarks = {
+        "map_build": lambda: bench_map_build(harness, country_schema, styles),
+        "autocomplete": lambda: bench_autocomplete(country_schema),
+        "zoom": lambda: bench_zoom(harness, geometry, country_schema, styles),
+        "zoom_raster": lambda: bench_zoom(harness, geometry, country_schema, styles, raster=True),
+        "state_churn": lambda: bench_state_churn(harness, geometry, country_schema, styles),
+        "hover": lambda: bench_hover(harness, geometry, country_schema, styles),
+        "game_replay": lambda: bench_game_replay(country_schema),
+    }
+    results = {}
+    for name, benchmark in benchmarks.items():
+        runs = [benchmark() for _ in range(repeat)]
+        # The median of each metric over the repeats.
+        results[name] = {metric: statistics.median(r[metric] for r in runs) for metric in runs[0]}
+    return results
+
+
+def milliseconds(metric, value):
+    if metric.endswith("_ms"):
+        return value
+    if metric.endswith("_s"):
+        return value * 1000
+    return None
+
+
+def compare(results, baseline, threshold, min_delta_ms):
+    regressions = []
+    for name, metrics in baseline.items():
+        for metric, reference in metrics.items():
+            value = results.get(name, {}).get(metric)
+            if value is None or not reference or value <= reference * (1 + threshold):
+                continue
+            if milliseconds(metric, value) is None or (
+                    milliseconds(metric, value) - milliseconds(metric, reference) > min_delta_ms):
+                regressions.append(f"{name}.{metric}: {value:.4g} > {reference:.4g} (+{value / reference - 1:.0%})")
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--tk", action="store_true", help="Use a real tk.Canvas, which needs a display.")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--threshold", type=float, default=0.25, help="Allowed fractional increase over baseline.")
+    parser.add_argument("--min-delta-ms", type=float, default=1.0, help="Allowed absolute slowdown of timings.")
+    parser.add_argument("--baseline", type=pathlib.Path, default=baseline_path)
+    parser.add_argument("--output", type=pathlib.Path, help="Also write the results to this JSON file.")
+    parser.add_argument("--update-baseline", action="store_true")
+    args = parser.parse_args()
+
+    results = run(Harness(args.tk), args.repeat)
+    print(json.dumps(results, indent=2))
+    if args.output:
+        args.output.write_text(json.dumps(results, indent=2))
+    if args.update_baseline:
+        args.baseline.write_text(json.dumps(results, indent=2) + "\n")
+    elif args.baseline.exists():
+        regressions = compare(
+            results, json.loads(args.baseline.read_text()), args.threshold, args.min_delta_ms,
+        )
+        for regression in regressions:
+            print(f"REGRESSION {regression}", file=sys.stderr)
+        sys.exit(1 if regressions else 0)
@@ -0,0 +1,193 @@
+"""Ranking of choices against typed text for FuzzyAutoComplete."""
+
+import collections
+
+import numpy as np
+
+
+def ngrams(text, n):
+    return {text[i:i + n] for i in range(len(text) - n + 1)}
+
+
+class CandidateStore:
+    def __init__(self, names, version=0):
+        """Ordered set of candidate names where names can be removed and restored in O(1).
+
+        Names keep their original position. ``version`` is bumped on every change so results can be cached against it.
+        """
+        self.names = list(names)
+        self.positions = {name: i for i, name in enumerate(self.names)}
+        self.active = np.ones(len(self.names), dtype=bool)
+        self._n_active = len(self.names)
+        self.version = version
+
+    def __len__(self):
+        return self._n_active
+
+    def __contains__(self, name):
+        i = self.positions.get(name)
+        return i is not None and bool(self.active[i])
+
+    def __iter__(self):
+        return (self.names[i] for i in np.flatnonzero(self.active))
+
+    def remove(self, name):
+        """Remove a name. Unknown or already removed names are ignored."""
+        i = self.positions.get(name)
+        if i is not None and self.active[i]:
+            self.active[i] = False
+            self._n_active -= 1
+            self.version += 1
+
+    def restore(self, name):
+        """Restore a removed name. Names which were never candidates are ignored."""
+        i = self.positions.get(name)
+        if i is not None and not self.active[i]:
+            self.active[i] = True
+            self._n_active += 1
+            self.version += 1
+
+
+class FuzzyMatcher:
+    def __init__(self, choices, ngram=2, cache_size=128):
+        """Pre-normalise ``choices`` and index them by their character n-grams and character counts.
+
+        Choices can be removed and restored cheaply through ``store`` without rebuilding the indexes.
+
+        Ranked results are kept in an LRU cache keyed by the normalised query and the version of the choices, and
+        the per-query candidate state is reused when a query extends a previous one.
+        """
+        self.ngram = ngram
+        self.cache_size = cache_size
+        self.store = CandidateStore([])
+        self._results = collections.OrderedDict()
+        self._prefix_states = collections.OrderedDict()
+        self.set_choices(choices)
+
+    @property
+    def version(self):
+        return self.store.version
+
+    def set_choices(self, choices):
+        """Replace the choices, rebuilding the indexes and invalidating cached results."""
+        self.store = CandidateStore(choices, version=self.store.version + 1)
+        self._results.clear()
+        self._prefix_states.clear()
+        self.choices = self.store.names
+        self.normalised = [choice.lower() for choice in self.choices]
+        self.lengths = np.array([len(choice) for choice in self.normalised], dtype=int)
+        self._index = collections.defaultdict(list)
+        for i, choice in enumerate(self.normalised):
+            for gram in ngrams(choice, self.ngram):
+                self._index[gram].append(i)
+        self._alphabet = {char: i for i, char in enumerate(sorted(set("".join(self.normalised))))}
+        self._char_counts = np.zeros((len(self.choices), len(self._alphabet)), dtype=np.int16)
+        for i, choice in enumerate(self.normalised):
+            for char, count in collections.Counter(choice).items():
+                self._char_counts[i, self._alphabet[char]] = count
+
+    def _prefix_state(self, query):
+        """Return the n-gram candidates of the query and the number of characters each choice shares with it.
+
+        If a prefix of the query was seen before, only the characters added since are processed: the query gains at
+        most one n-gram per character, and a choice shares an extra character only if it has more of it.
+        """
+        state = self._prefix_states.get(query)
+        if state is not None:
+            self._prefix_states.move_to_end(query)
+            return state
+        for end in range(len(query) - 1, -1, -1):
+            if query[:end] in self._prefix_states:
+                candidates, shared, counts = self._prefix_states[query[:end]]
+                break
+        else:
+            end = 0
+            candidates, shared, counts = frozenset(), np.zeros(len(self.choices), dtype=int), collections.Counter()
+        candidates = set(candidates)
+        shared = shared.copy()
+        counts = counts.copy()
+        for i in range(end, len(query)):
+            char = query[i]
+            if char in self._alphabet:
+                shared += self._char_counts[:, self._alphabet[char]] > counts[char]
+            counts[char] += 1
+            if i + 1 >= self.ngram:
+                candidates.update(self._index.get(query[i + 1 - self.ngram:i + 1], ()))
+        state = (frozenset(candidates), shared, counts)
+        self._prefix_states[query] = state
+        if len(self._prefix_states) > self.cache_size:
+            self._prefix_states.popitem(last=False)
+        return state
+
+    def candidates(self, query):
+        """Indexes of active choices sharing an n-gram with the query."""
+        candidates = np.array(sorted(self._prefix_state(query)[0]), dtype=int)
+        return candidates[self.store.active[candidates]]
+
+    def upper_bounds(self, query):
+        """Upper bound of the score of every choice, from the characters it shares with the query.
+
+        A ratio is 2 * LCS / (len(a) + len(b)), and the LCS cannot exceed the number of shared characters m. For the
+        partial ratio the pairs compared are the shorter string s against windows w no longer than it, bounded by
+        2m / (s + m). For the prefix ratio the lengths are fixed.
+        """
+        shared = self._prefix_state(query)[1]
+        shortest = np.minimum(self.lengths, len(query))
+        with np.errstate(divide="ignore", invalid="ignore"):
+            partial = np.where(shortest > 0, 200 * shared / (shortest + shared), 0)
+            prefix = np.where(shortest > 0, 200 * np.minimum(shared, shortest) / (len(query) + shortest), 100)
+        return np.ceil(np.nan_to_num(np.maximum(partial, prefix), nan=0)).astype(int)
+
+    def scores(self, query, indexes):
+        """Score the choices at ``indexes`` as the max of partial ratio and ratio against the same-length prefix.
+
+        Matches ``thefuzz.fuzz``, which rounds the rapidfuzz scores to integers.
+        """
+        # Imported here, on the first ranking, so the menu can be shown without loading rapidfuzz.
+        from rapidfuzz import fuzz, process
+
+        choices = [self.normalised[i] for i in indexes]
+        if not choices:
+            return np.zeros(0, dtype=int)
+        partial = process.cdist([query], choices, scorer=fuzz.partial_ratio, dtype=np.float64)[0]
+        prefix = process.cdist(
+            [query], [choice[:len(query)] for choice in choices], scorer=fuzz.ratio, dtype=np.float64,
+        )[0]
+        return np.rint(np.maximum(partial, prefix)).astype(int)
+
+    def top_k(self, query, k=20):
+        """Return the k best choices for the query, best first. Ties keep the original order of the choices.
+
+        Choices sharing an n-gram with the query are scored first. The rest are only scored if their upper bound
+        could still reach the k-th best score, so the result is the same as scoring everything.
+        """
+        query = query.lower()
+        key = (query, self.version, k)
+        if key in self._results:
+            self._results.move_to_end(key)
+        else:
+            self._results[key] = tuple(self._top_k(query, k))
+            if len(self._results) > self.cache_size:
+                self._results.popitem(last=False)
+        return list(self._results[key])
+
+    def _top_k(self, query, k):
+        n = len(self.choices)
+        if len(self.store) == 0 or k <= 0:
+            return []
+        indexes = self.candidates(query)
+        scores = self.scores(query, indexes)
+        threshold = np.partition(scores, len(scores) - k)[len(scores) - k] if len(scores) >= k else 0
+        unscored = self.store.active.copy()
+        unscored[indexes] = False
+        extra = np.flatnonzero(unscored & (self.upper_bounds(query) >= threshold))
+        indexes = np.concatenate([indexes, extra])
+        scores = np.concatenate([scores, self.scores(query, extra)])
+        # Single sort key so that partial selection also breaks ties by the original order.
+        keys = scores * (n + 1) + (n - indexes)
+        if len(keys) > k:
+            best = np.argpartition(-keys, k - 1)[:k]
+        else:
+            best = np.arange(len(keys))
+        best = best[np.argsort(-keys[best])]
+        return [self.choices[i] for i in indexes[best]]
@@ -0,0 +1,217 @@
+"""Game rules without Tk: guessing country names, undoing guesses and verifying them.
+
+GameSchema holds the read-only country data shared by every session. GameSession keeps the state of one game in small
+integer arrays so that guess and undo are O(1) and verify is O(pending guesses). ``replay`` runs scripted games in
+bulk for load tests.
+"""
+
+import collections
+import enum
+
+import numpy as np
+
+
+GameState = enum.IntEnum("GameState", "open guessed verified disputed", start=0)
+# Codes of the actions in a script for GameSession.run_script and replay.
+GUESS, UNDO, VERIFY = 0, 1, 2
+NO_GUESS = -1
+
+VerifyResult = collections.namedtuple("VerifyResult", "correct incorrect")
+
+
+class GameSchema:
+    def __init__(self, countries, disputed):
+        """Countries to guess, in a fixed order, and whether each is disputed (and so not part of the game)."""
+        self.countries = list(countries)
+        self.index = {name: i for i, name in enumerate(self.countries)}
+        self.disputed = np.asarray(disputed, dtype=bool)
+        self.n_valid = int((~self.disputed).sum())
+        self.initial_state = np.where(self.disputed, GameState.disputed, GameState.open).astype(np.int8)
+
+    @classmethod
+    def from_country_schema(cls, country_schema):
+        return cls(country_schema.index, country_schema["disputed"].to_numpy())
+
+    def guess_id(self, name):
+        """Index of a guessed name. Names which are not countries get ids past the countries, see GameSession."""
+        return self.index.get(name, NO_GUESS)
+
+
+class GameSession:
+    def __init__(self, schema):
+        self.schema = schema
+        self.state = schema.initial_state.copy()
+        # Index of the guessed name for each country. Names which are not countries are interned in _other_guesses.
+        self.guesses = np.full(len(schema.countries), NO_GUESS, dtype=np.int32)
+        self._other_guesses = {}
+        self._other_names = []
+        # Countries with an unverified guess, in the order they were guessed.
+        self._pending = {}
+        self.n_correct = 0
+        self.score = 0
+
+    def reset(self):
+        """Start a new game, reusing the arrays."""
+        self.state[:] = self.schema.initial_state
+        self.guesses[:] = NO_GUESS
+        self._pending.clear()
+        self.n_correct = 0
+        self.score = 0
+
+    @property
+    def progress(self):
+        """Number of countries either verified or guessed."""
+        return self.n_correct + len(self._pending)
+
+    @property
+    def finished(self):
+        return self.n_correct == self.schema.n_valid
+
+    def _name_id(self, name):
+        i = self.schema.guess_id(name)
+        if i == NO_GUESS:
+            i = self._other_guesses.get(name)
+            if i is None:
+                i = self._other_guesses[name] = len(self.schema.countries) + len(self._other_names)
+                self._other_names.append(name)
+        return i
+
+    def _name(self, i):
+        if i < len(self.schema.countries):
+            return self.schema.countries[i]
+        return self._other_names[i - len(self.schema.countries)]
+
+    def display_name(self, country):
+        """Name to show for a country: its guess, or its name once verified."""
+        i = self.schema.index[country]
+        if self.state[i] == GameState.guessed:
+            return self._name(self.guesses[i])
+        if self.state[i] == GameState.verified:
+            return country
+        return ""
+
+    def guess(self, country, name):
+        """Guess the name of an open country. Returns whether the guess was made."""
+        i = self.schema.index[country]
+        if not name or self.state[i] != GameState.open:
+            return False
+        self._guess(i, self._name_id(name))
+        return True
+
+    def _guess(self, i, guess):
+        self.state[i] = GameState.guessed
+        self.guesses[i] = guess
+        self._pending[i] = None
+
+    def undo(self, country):
+        """Withdraw the guess of a country. Returns the guessed name, which is available again, or None."""
+        i = self.schema.index[country]
+        if self.state[i] != GameState.guessed:
+            return None
+        return self._name(self._undo(i))
+
+    def _undo(self, i):
+        guess = self.guesses[i]
+        self.state[i] = GameState.open
+        self.guesses[i] = NO_GUESS
+        del self._pending[i]
+        return guess
+
+    def verify(self):
+        """Mark the pending guesses. Correct ones become verified, incorrect ones are open again.
+
+        Each correct guess scores a point and each incorrect one loses a point.
+        """
+        correct, incorrect = self._verify()
+        return VerifyResult(
+            [self.schema.countries[i] for i in correct],
+            [(self.schema.countries[i], self._name(guess)) for i, guess in incorrect],
+        )
+
+    def _verify(self):
+        correct = []
+        incorrect = []
+        for i in self._pending:
+            guess = self.guesses[i]
+            self.guesses[i] = NO_GUESS
+            if guess == i:
+                self.state[i] = GameState.verified
+                correct.append(i)
+            else:
+                self.state[i] = GameState.open
+                incorrect.append((i, guess))
+        self._pending.clear()
+        self.n_correct += len(correct)
+        self.score += len(correct) - len(incorrect)
+        return correct, incorrect
+
+    def run_script(self, script):
+        """Apply a script of (action, country index, guess id) rows, e.g. from ``encode_script``.
+
+        Actions which are not allowed in the current state are skipped, as they are in the game.
+        """
+        state = self.state
+        for action, i, guess in np.asarray(script).tolist():
+            if action == GUESS:
+                if state[i] == GameState.open:
+                    self._guess(i, guess)
+            elif action == UNDO:
+                if state[i] == GameState.guessed:
+                    self._undo(i)
+            elif action == VERIFY:
+                self._verify()
+
+    def encode_script(self, actions):
+        """Encode actions ("guess", country, name), ("undo", country) and ("verify",) into an int array."""
+        rows = []
+        for action in actions:
+            if action[0] == "guess":
+                rows.append((GUESS, self.schema.index[action[1]], self._name_id(action[2])))
+            elif action[0] == "undo":
+                rows.append((UNDO, self.schema.index[action[1]], NO_GUESS))
+            elif action[0] == "verify":
+                rows.append((VERIFY, NO_GUESS, NO_GUESS))
+            else:
+                raise ValueError(f"Unknown action {action[0]!r}")
+        return np.array(rows, dtype=np.int32).reshape(-1, 3)
+
+
+def replay(schema, scripts):
+    """Play encoded scripts, each from a new game, returning the final scores, progress and whether each finished.
+
+    The games are played in lockstep, one action of every game per step, so each step is a few array operations over
+    all games. Gives the same results as GameSession.run_script on each script.
+    """
+    n_games, n_countries = len(scripts), len(schema.countries)
+    n_steps = max((len(script) for script in scripts), default=0)
+    # Pad the scripts with no-op actions to the same length.
+    actions = np.full((n_games, n_steps, 3), NO_GUESS, dtype=np.int32)
+    for k, script in enumerate(scripts):
+        actions[k, :len(script)] = script
+    state = np.tile(schema.initial_state, (n_games, 1))
+    guesses = np.full((n_games, n_countries), NO_GUESS, dtype=np.int32)
+    n_correct = np.zeros(n_games, dtype=np.int32)
+    scores = np.zeros(n_games, dtype=np.int32)
+    games = np.arange(n_games)
+    countries = np.arange(n_countries)
+    for step in range(n_steps):
+        action, i, guess = actions[:, step].T
+        country = np.maximum(i, 0)
+        current = state[games, country]
+        make_guess = (action == GUESS) & (current == GameState.open)
+        state[games[make_guess], i[make_guess]] = GameState.guessed
+        guesses[games[make_guess], i[make_guess]] = guess[make_guess]
+        undo = (action == UNDO) & (current == GameState.guessed)
+        state[games[undo], i[undo]] = GameState.open
+        guesses[games[undo], i[undo]] = NO_GUESS
+        verify = np.flatnonzero(action == VERIFY)
+        if len(verify):
+            pending = state[verify] == GameState.guessed
+            correct = pending & (guesses[verify] == countries)
+            incorrect = pending & ~correct
+            state[verify] = np.where(correct, GameState.verified, np.where(incorrect, GameState.open, state[verify]))
+            guesses[verify] = np.where(pending, NO_GUESS, guesses[verify])
+            n_correct[verify] += correct.sum(axis=1)
+            scores[verify] += correct.sum(axis=1) - incorrect.sum(axis=1)
+    progress = n_correct + (state == GameState.guessed).sum(axis=1)
+    return scores, progress, n_correct == schema.n_valid
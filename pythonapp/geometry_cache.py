@@ -0,0 +1,243 @@
+"""Binary cache of projected country outlines.
+
+Reading the shapefile with geopandas and projecting every ring dominates start-up, so the projected screen
+coordinates are stored on disk as flat arrays which are memory-mapped on later launches:
+
+* ``coords``: float32 array of shape (n_vertices, 2) in screen coordinates.
+* ``ring_offsets``: int64 array of length n_rings + 1. Ring i is ``coords[ring_offsets[i]:ring_offsets[i + 1]]``.
+* ``country_offsets``: int64 array of length n_countries + 1. Country j owns rings
+  ``country_offsets[j]:country_offsets[j + 1]``.
+
+The arrays are stored once per level of detail, ``LOD_TOLERANCES`` giving the topology-preserving simplification
+tolerance (in degrees) of each level. Level 0 is full detail.
+
+The cache is keyed by a hash of the input files, so it is rebuilt automatically when they change.
+
+If a topology from tools/create_topology.py is given the rings are instead rebuilt from its arcs, so that the borders
+shared by neighbours are simplified and projected once and match at every level of detail. See the topology module.
+
+Otherwise the shapefile is read a batch of records at a time, without its attribute columns, and each batch is
+projected and dropped before the next is read. Either way, dense data such as the 10m or admin-1 datasets is kept
+within ``MEMORY_LIMIT`` by dropping the finest levels of detail, the coarser levels being simplified.
+"""
+
+import functools
+import json
+import mmap
+import os
+import pathlib
+
+import numpy as np
+
+import layout_schema
+from profiling import profiler
+import topology
+import utils
+
+
+CACHE_VERSION = 5
+_ARRAYS = ("coords", "ring_offsets", "country_offsets")
+LOD_TOLERANCES = (0.0, 0.05, 0.2, 0.5)
+# Bytes of projected vertices, over all levels, which a build may hold. The finest levels are dropped while it is
+# exceeded, always keeping the coarsest.
+MEMORY_LIMIT = 512 * 2 ** 20
+# Shapefile records read, and their geometries held, at a time.
+BATCH_SIZE = 16
+# Largest simplification error, in pixels, which we accept on screen.
+LOD_MAX_ERROR = 1.0
+# Screen pixels per degree at a zoom of 1. See utils.world_to_screen.
+_PIXELS_PER_DEGREE = 2 * 1.35
+
+
+def input_hash(region_path, country_schema_path, memory_limit=MEMORY_LIMIT, topology_path=None):
+    """Hash the shapefile (with its sidecar files), the country schema, the topology if any and the build settings."""
+    return utils.hash_files(
+        utils.shapefile_paths(region_path) + [country_schema_path] + ([topology_path] if topology_path else []),
+        f"version={CACHE_VERSION} lod={LOD_TOLERANCES} memory_limit={memory_limit}",
+    )
+
+
+def lod_level(imscale, tolerances=LOD_TOLERANCES):
+    """Return the coarsest level of detail whose simplification error is invisible at the given zoom."""
+    level = 0
+    for i, tolerance in enumerate(tolerances):
+        if tolerance * _PIXELS_PER_DEGREE * imscale <= LOD_MAX_ERROR:
+            level = i
+    return level
+
+
+def _map_array(path):
+    """Memory-map a .npy file read-only, returning the array and its mmap."""
+    with open(path, "rb") as f:
+        version = np.lib.format.read_magic(f)
+        read_header = np.lib.format.read_array_header_1_0 if version == (1, 0) else np.lib.format.read_array_header_2_0
+        shape, fortran_order, dtype = read_header(f)
+        offset = f.tell()
+        mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    array = np.ndarray(shape, dtype, buffer=mapped, offset=offset, order="F" if fortran_order else "C")
+    return array, mapped
+
+
+class GeometryCache:
+    def __init__(self, path):
+        """Memory-map a cache previously written by ``build``. ``path`` is the cache prefix without extension."""
+        path = pathlib.Path(path)
+        with open(path.with_suffix(".json"), "r") as f:
+            manifest = json.load(f)
+        self.path = path
+        self.names = manifest["names"]
+        self.tolerances = manifest["tolerances"]
+        self._name_index = {name: i for i, name in enumerate(self.names)}
+        self.levels = []
+        self._mmaps = []
+        for level in range(len(self.tolerances)):
+            mapped = {name: _map_array(path.with_suffix(f".L{level}.{name}.npy")) for name in _ARRAYS}
+            self.levels.append({name: array for name, (array, _) in mapped.items()})
+            self._mmaps.append([m for _, m in mapped.values()])
+
+    def release(self):
+        """Drop the pages of the cache held in memory. They are read back from the file, or the page cache, when next
+        used.
+        """
+        if not hasattr(mmap, "MADV_DONTNEED"):
+            return
+        for mmaps in self._mmaps:
+            for m in mmaps:
+                m.madvise(mmap.MADV_DONTNEED)
+
+    def lod_level(self, imscale):
+        """Level of detail for the zoom among the levels in this cache, see ``lod_level``."""
+        return lod_level(imscale, self.tolerances)
+
+    def vertex_count(self, level):
+        """Return the total number of vertices stored at a level of detail."""
+        return len(self.levels[level]["coords"])
+
+    def rings(self, name, level=0):
+        """Return the projected rings of a country as float32 views into the cache."""
+        i = self._name_index[name]
+        arrays = self.levels[level]
+        country_offsets = arrays["country_offsets"]
+        ring_offsets = arrays["ring_offsets"][country_offsets[i]:country_offsets[i + 1] + 1]
+        coords = arrays["coords"]
+        return [coords[start:stop] for start, stop in zip(ring_offsets[:-1], ring_offsets[1:])]
+
+    def country_coords(self, name, level=0):
+        """Return the vertices of all the rings of a country as one float32 view, and the ring offsets into it.
+
+        Cheaper than ``rings`` when the rings are transformed together.
+        """
+        i = self._name_index[name]
+        arrays = self.levels[level]
+        country_offsets = arrays["country_offsets"]
+        ring_offsets = np.asarray(arrays["ring_offsets"][country_offsets[i]:country_offsets[i + 1] + 1])
+        return arrays["coords"][ring_offsets[0]:ring_offsets[-1]], ring_offsets - ring_offsets[0]
+
+    @staticmethod
+    def _project_batch(geometries, tolerance):
+        """Project the rings of a batch of regions, returning (coords, ring lengths) of each region."""
+        import shapely
+
+        if tolerance:
+            geometries = shapely.simplify(geometries, tolerance, preserve_topology=True)
+        coords, ring_offsets, geometry_offsets = utils.extract_rings(geometries)
+        coords = utils.project_rings(coords, dtype=np.float32)
+        ring_lengths = np.diff(ring_offsets)
+        vertex_offsets = ring_offsets[geometry_offsets]
+        return [
+            (coords[vertex_offsets[k]:vertex_offsets[k + 1]], ring_lengths[geometry_offsets[k]:geometry_offsets[k + 1]])
+            for k in range(len(geometries))
+        ]
+
+    @staticmethod
+    def _pack(regions, region_indexes):
+        """Concatenate the projected regions of every country, in schema order, into the cache arrays."""
+        parts = [regions[region] for indexes in region_indexes for region in indexes]
+        rings_per_region = np.array([len(ring_lengths) for _, ring_lengths in parts], dtype=np.int64)
+        region_offsets = np.cumsum([0] + [len(indexes) for indexes in region_indexes])
+        ring_lengths = np.concatenate([ring_lengths for _, ring_lengths in parts] + [np.zeros(0, dtype=np.int64)])
+        return {
+            "coords": np.concatenate([coords for coords, _ in parts] + [np.zeros((0, 2), dtype=np.float32)]),
+            "ring_offsets": np.concatenate(([0], np.cumsum(ring_lengths))).astype(np.int64),
+            "country_offsets": np.concatenate(([0], np.cumsum(rings_per_region)))[region_offsets].astype(np.int64),
+        }
+
+    @classmethod
+    def build(cls, path, region_path, country_schema_path, memory_limit=MEMORY_LIMIT, batch_size=BATCH_SIZE,
+              topology_path=None):
+        """Read the shapefile, or the topology made from it, project every country in the schema and write the cache
+        to ``path``.
+
+        Only the territories listed in the schema's ``region_indexes`` are read, so negligible islands are dropped.
+        """
+        path = pathlib.Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        names, region_indexes = layout_schema.read_region_indexes(country_schema_path)
+        wanted = sorted({region for indexes in region_indexes for region in indexes})
+
+        # The projected regions of each level of detail, by region index. None once a level is dropped.
+        levels = [{} for _ in LOD_TOLERANCES]
+        nbytes = [0] * len(LOD_TOLERANCES)
+        first = 0
+        if topology_path is None:
+            batches = (
+                (batch, functools.partial(cls._project_batch, geometries))
+                for batch, geometries in utils.iter_region_geometries(region_path, wanted, batch_size)
+            )
+        else:
+            arcs = topology.Topology(topology_path)
+            batches = (
+                (batch, functools.partial(arcs.project, batch))
+                for batch in (wanted[start:start + batch_size] for start in range(0, len(wanted), batch_size))
+            )
+        with profiler.phase("project_geometry"):
+            # project(tolerance) returns the projected regions of the batch.
+            for batch, project in batches:
+                for level in range(first, len(LOD_TOLERANCES)):
+                    projected = project(LOD_TOLERANCES[level])
+                    levels[level].update(zip(batch, projected))
+                    nbytes[level] += sum(coords.nbytes for coords, _ in projected)
+                while first < len(LOD_TOLERANCES) - 1 and sum(nbytes[first:]) > memory_limit:
+                    levels[first] = None
+                    if topology_path is not None:
+                        arcs.forget(LOD_TOLERANCES[first])
+                    first += 1
+                    profiler.count("lod_levels_dropped")
+
+        for level in range(first, len(LOD_TOLERANCES)):
+            arrays = cls._pack(levels[level], region_indexes)
+            levels[level] = None
+            # Write the arrays first and the manifest last, so a partially written cache is never picked up.
+            for name, array in arrays.items():
+                tmp_path = path.with_suffix(f".L{level - first}.{name}.tmp.npy")
+                np.save(tmp_path, array)
+                os.replace(tmp_path, path.with_suffix(f".L{level - first}.{name}.npy"))
+        tmp_path = path.with_suffix(".json.tmp")
+        with open(tmp_path, "w") as f:
+            json.dump({"version": CACHE_VERSION, "names": names, "tolerances": list(LOD_TOLERANCES[first:])}, f)
+        os.replace(tmp_path, path.with_suffix(".json"))
+        return cls(path)
+
+    @classmethod
+    def load(cls, cache_dir, region_path, country_schema_path, memory_limit=MEMORY_LIMIT, topology_path=None):
+        """Load the cache matching the current inputs, rebuilding it (and discarding stale ones of the same shapefile)
+        if needed.
+
+        The topology at ``topology_path`` is used if it was made from the shapefile ``region_path``.
+        """
+        cache_dir = pathlib.Path(cache_dir)
+        if topology_path is not None and not topology.built_from(topology_path, region_path):
+            topology_path = None
+        key = input_hash(region_path, country_schema_path, memory_limit, topology_path)
+        # One cache is kept per shapefile, so that switching between datasets does not rebuild them.
+        prefix = f"geometry_{pathlib.Path(region_path).stem}_"
+        path = cache_dir / f"{prefix}{key}"
+        if path.with_suffix(".json").exists():
+            try:
+                return cls(path)
+            except (OSError, ValueError, KeyError):
+                pass
+        for stale in cache_dir.glob(f"{prefix}*"):
+            if not stale.name.startswith(path.name):
+                stale.unlink()
+        return cls.build(path, region_path, country_schema_path, memory_limit, topology_path=topology_path)
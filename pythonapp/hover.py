@@ -0,0 +1,54 @@
+"""Tracks the country under the cursor, raising Enter and Leave once per country rather than per polygon.
+
+Motion is hit tested at most once per frame, so sweeping the cursor across the map costs one state change per frame
+at most, and none while it stays within one country.
+"""
+
+from profiling import profiler
+from utils import FRAME_MS
+
+
+class HoverController:
+    def __init__(self, canvas, find, frame_ms=FRAME_MS):
+        """Hover over the items of ``canvas``, where ``find(x, y)`` returns the name under window coordinates."""
+        self.canvas = canvas
+        self.find = find
+        self.frame_ms = frame_ms
+        self.hovered = None
+        self.enter_callbacks = []
+        self.leave_callbacks = []
+        # Window coordinates of the last motion, or None once the cursor left the canvas.
+        self._position = None
+        self._update_id = None
+
+    def motion(self, event):
+        self._position = (event.x, event.y)
+        self._schedule()
+
+    def leave(self, event):
+        self._position = None
+        self._schedule()
+
+    def _schedule(self):
+        if self._update_id is None:
+            self._update_id = self.canvas.after(self.frame_ms, self.update)
+
+    @profiler.timed("hover")
+    def update(self):
+        """Hit test the last position and raise Leave and Enter if it is over another country."""
+        if self._update_id is not None:
+            self.canvas.after_cancel(self._update_id)
+            self._update_id = None
+        self.set_hovered(None if self._position is None else self.find(*self._position))
+
+    def set_hovered(self, name):
+        if name == self.hovered:
+            return
+        old_name, self.hovered = self.hovered, name
+        profiler.count("hover_changes")
+        if old_name is not None:
+            for func in self.leave_callbacks:
+                func(old_name)
+        if name is not None:
+            for func in self.enter_callbacks:
+                func(name)
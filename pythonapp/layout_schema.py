@@ -0,0 +1,74 @@
+"""The country schema written by tools/create_layout_schema.py: for each country its names, the indexes of its regions
+in the shapefile, its colour code, drawing order and whether it is disputed.
+
+The schema is stored as a compressed npz of typed columns. The list columns, ``names`` and ``region_indexes``, are stored flat
+with offsets: country i has ``names[names_offsets[i]:names_offsets[i + 1]]``. Loading needs neither pickle nor parsing
+Python literals. ``input_hash`` records the inputs the schema was made from, so the tool can skip unchanged reruns.
+"""
+
+import numpy as np
+
+import utils
+
+
+SCHEMA_VERSION = 1
+LIST_COLUMNS = ("names", "region_indexes")
+COLUMNS = ("colour", "order", "disputed")
+
+
+def _flatten(lists, dtype):
+    offsets = np.cumsum([0] + [len(values) for values in lists], dtype=np.int64)
+    values = [value for values in lists for value in values]
+    return np.array(values, dtype=dtype), offsets
+
+
+def _unflatten(values, offsets):
+    values = values.tolist()
+    offsets = offsets.tolist()
+    return [values[start:stop] for start, stop in zip(offsets[:-1], offsets[1:])]
+
+
+def write_country_schema(path, schema, input_hash):
+    """Write the DataFrame ``schema``, indexed by country, to the npz file ``path``."""
+    arrays = {
+        "country": np.array(schema.index.tolist(), dtype=str),
+        "colour": np.array(schema["colour"].tolist(), dtype=str),
+        "order": schema["order"].to_numpy(dtype=np.int64),
+        "disputed": schema["disputed"].to_numpy(dtype=bool),
+    }
+    arrays["names"], arrays["names_offsets"] = _flatten(schema["names"], str)
+    arrays["region_indexes"], arrays["region_indexes_offsets"] = _flatten(schema["region_indexes"], np.int64)
+    utils.write_npz(path, arrays, SCHEMA_VERSION, input_hash)
+
+
+def _load(path):
+    return utils.load_npz(path, SCHEMA_VERSION, "schema")
+
+
+def read_input_hash(path):
+    """The hash of the inputs the schema was made from, or None if there is no readable schema."""
+    return utils.read_npz_input_hash(path, SCHEMA_VERSION, "schema")
+
+
+def read_valid_countries(path):
+    """Names of the countries to guess, read without pandas so that the menu can be shown before the map loads."""
+    with _load(path) as data:
+        return data["country"][~data["disputed"]].tolist()
+
+
+def read_region_indexes(path):
+    """The country names and the list of region indexes of each country."""
+    with _load(path) as data:
+        return data["country"].tolist(), _unflatten(data["region_indexes"], data["region_indexes_offsets"])
+
+
+def read_country_schema(path):
+    """Read the schema into a DataFrame indexed by country, with list columns ``names`` and ``region_indexes``."""
+    import pandas as pd
+
+    with _load(path) as data:
+        columns = {column: data[column] for column in COLUMNS}
+        for column in LIST_COLUMNS:
+            columns[column] = _unflatten(data[column], data[f"{column}_offsets"])
+        index = pd.Index(data["country"].tolist(), name="country")
+    return pd.DataFrame(columns, index=index)[["names", "region_indexes", "colour", "order", "disputed"]]
@@ -1,15 +1,20 @@
-import ast
+import argparse
+import functools
 import pathlib
+import queue
+import threading
 import tkinter as ttk
 
-import pandas as pd
-import yaml
-
+from game import GameSchema, GameSession
+from geometry_cache import GeometryCache
+from layout_schema import read_country_schema, read_valid_countries
 from menu import Menu
+from profiling import profiler
 import tkk_plus
-import utils
+from utils import FRAME_MS
 from world_map import (
     CountryState,
+    StyleTable,
     WorldMap,
 )
 
@@ -17,44 +22,42 @@ from world_map import (
 root_path = pathlib.Path(__file__).resolve().parents[1]
 resource_path = root_path / "resources"
 region_path = resource_path / "Natural_Earth_50m_cultural" / "ne_50m_admin_0_countries.shp"
-country_schema_path = resource_path / "country_schema.csv"
+country_schema_path = resource_path / "country_schema.npz"
+topology_path = resource_path / "topology.npz"
 style_schema_path = resource_path / "style_schema.yaml"
+cache_path = resource_path / "cache"
 
 
-regions = utils.read_regions(region_path).set_index("SOVEREIGNT")
-country_schema = pd.read_csv(
-    country_schema_path,
-    index_col="country",
-    converters={
-        "names": ast.literal_eval,
-        "region_indexes": ast.literal_eval,
-        # "colour": str,
-    },
-)
-with open(style_schema_path, "r") as f:
-    style_schema = yaml.safe_load(f)
+def load_resources(region_path=region_path, country_schema_path=country_schema_path, topology_path=topology_path):
+    """Load the geometry, country schema and styles. Other datasets, e.g. 10m or admin-1, need their own schema.
+
+    The geometry is built from the shared-border topology if it was made from the shapefile, else from the shapefile.
+    """
+    # Imported here so the window can be shown before yaml is loaded.
+    import yaml
+
+    with profiler.phase("load_geometry"):
+        geometry = GeometryCache.load(cache_path, region_path, country_schema_path, topology_path=topology_path)
+    with profiler.phase("read_country_schema"):
+        country_schema = read_country_schema(country_schema_path)
+    with profiler.phase("read_style_schema"):
+        with open(style_schema_path, "r") as f:
+            styles = StyleTable(yaml.safe_load(f))
+        styles.validate_codes(country_schema["colour"])
+    return geometry, country_schema, styles
 
 
 class GoWhere:
-    def __init__(self, master_frame, regions, country_schema, style_schema):
+    def __init__(self, master_frame, valid_countries, raster=False, retain_geometry=True):
+        """Create the menu and an empty map. The map is drawn by ``load_map`` once the resources are loaded."""
         # Stop changing focus with tab key.
         root.unbind_all("<<NextWindow>>")
         root.unbind_all("<<PrevWindow>>")
         map_frame = tkk_plus.ZoomFrame(root)
-        canvas = map_frame.canvas
-        world_map = WorldMap(
-            canvas, regions, country_schema, style_schema,
-            country_bindings=[
-                ("<Enter>", self.apply_highlight_country),
-                ("<Leave>", self.remove_highlight_country),
-                ("<ButtonRelease-1>", self.weak_select_country),
-                ("<Double-Button-1>", self.strong_select_country),
-            ],
-            )
 
         menu_frame = ttk.Frame(root)
-        valid_countries = country_schema.index[~country_schema["disputed"]]
-        menu = Menu(menu_frame, valid_countries, self.make_guess, self.verify_results)
+        with profiler.phase("menu"):
+            menu = Menu(menu_frame, valid_countries, self.make_guess, self.verify_results)
 
         menu_frame.grid(row=0, sticky="NW")
         map_frame.grid(row=1, sticky="NSEW")
@@ -65,43 +68,102 @@ class GoWhere:
 
         self.valid_countries = valid_countries
         self.master_frame = master_frame
+        self.map_frame = map_frame
+        self.raster = raster
+        self.retain_geometry = retain_geometry
         self.menu = menu
-        self.world_map = world_map
-        self.countries_guessed = pd.Series(dtype="object")
-        self.countries_correct = []
-        self.deselect_country(regions.index[0])
+        self.world_map = None
+        self.session = None
 
+    def load_map(self, geometry, country_schema, styles):
+        map_frame = self.map_frame
+        canvas = map_frame.canvas
+        with profiler.phase("world_map"):
+            world_map = WorldMap(
+                canvas, geometry, country_schema, styles,
+                country_bindings=[
+                    ("<Enter>", self.apply_highlight_country),
+                    ("<Leave>", self.remove_highlight_country),
+                    ("<ButtonRelease-1>", self.weak_select_country),
+                    ("<Double-Button-1>", self.strong_select_country),
+                ],
+                raster=self.raster,
+                retain_geometry=self.retain_geometry,
+            )
+        profiler.add_gauge("canvas_items", lambda: len(canvas.find_all()))
+        profiler.add_gauge("canvas_bound_sequences", lambda: len(canvas.bind()))
+        map_frame.zoom_callbacks.append(world_map.set_zoom)
+        map_frame.view_callbacks.append(world_map.update_visible)
+        map_frame.set_extent(world_map.extent)
+        # Follow any zoom made while the map was loading, and draw what is in view at that zoom.
+        world_map.set_zoom(map_frame.imscale, map_frame.origin)
+        map_frame.view_changed()
+
+        self.world_map = world_map
+        # The game rules live in the session, this class only connects them to the widgets.
+        self.session = GameSession(GameSchema.from_country_schema(country_schema))
+        self.deselect_country(country_schema.index[0])
+
+    def load_map_in_background(self, load):
+        """Call ``load()`` on a worker thread and then ``load_map`` with the resources it returns, on the Tk thread.
+
+        The window stays responsive while the resources are read and the geometry cache is built. The worker's result
+        is passed back through a queue, polled every frame.
+        """
+        results = queue.Queue()
+
+        def work():
+            try:
+                results.put((load(), None))
+            except Exception as error:
+                results.put((None, error))
+
+        def poll():
+            try:
+                resources, error = results.get_nowait()
+            except queue.Empty:
+                self.master_frame.after(FRAME_MS, poll)
+                return
+            if error is not None:
+                raise error
+            self.load_map(*resources)
+            self.master_frame.after_idle(profiler.snapshot)
+
+        threading.Thread(target=work, name="load_map", daemon=True).start()
+        self.master_frame.after(FRAME_MS, poll)
+
+    @profiler.timed("make_guess")
     def make_guess(self, user_entry):
+        if self.world_map is None:
+            return
         selected_country = self.world_map.selected
-        if (selected_country and user_entry):
-            self.countries_guessed[selected_country.name] = user_entry
+        if selected_country and self.session.guess(selected_country.name, user_entry):
             self.menu.remove_country_option(user_entry)
             self.menu.reset_user_entry()
-            self.menu.progress = len(self.countries_correct) + len(self.countries_guessed)
+            self.menu.progress = self.session.progress
             selected_country.state = CountryState.guessed
             self.deselect_country(selected_country.name)
 
+    @profiler.timed("verify_results")
     def verify_results(self):
-        marking = self.countries_guessed.index == self.countries_guessed
-        correct = self.countries_guessed.index[marking]
-        incorrect = self.countries_guessed.index[~marking]
+        if self.session is None:
+            return
+        correct, incorrect = self.session.verify()
 
         print(f"You got {len(correct)} correct and {len(incorrect)} incorrect")
 
-        self.countries_correct.extend(correct)
         for country in correct:
             self.world_map.countries[country].state = CountryState.verified
-        for country, guess in self.countries_guessed[incorrect].items():
+        for country, guess in incorrect:
             self.world_map.countries[country].state = CountryState.open
             self.menu.add_country_option(guess)
-        self.menu.score += marking.sum() - (~marking).sum()
-        self.menu.progress = len(self.countries_correct)
-
-        self.countries_guessed = pd.Series(dtype="object")
+        self.menu.score = self.session.score
+        self.menu.progress = self.session.progress
 
-        if len(self.countries_correct) == len(self.valid_countries):
+        if self.session.finished:
             print(f"Finished with score {self.menu.score}!")
 
+    @profiler.timed("apply_highlight_country")
     def apply_highlight_country(self, name):
         country = self.world_map.countries[name]
         old_country = self.world_map.highlighted
@@ -109,13 +171,16 @@ class GoWhere:
             self.remove_highlight_country(old_country.name)
         if country.state == CountryState.open:
             country.state = CountryState.highlighted
-        display_text = self.countries_guessed.get(name) or (name if name in self.countries_correct else "")
-        self.menu.display_country(display_text)
+            self.world_map.highlighted = country
+        self.menu.display_country(self.session.display_name(name))
 
+    @profiler.timed("remove_highlight_country")
     def remove_highlight_country(self, name):
         country = self.world_map.countries[name]
         if country.state == CountryState.highlighted:
             country.state = CountryState.open
+        if self.world_map.highlighted is country:
+            self.world_map.highlighted = None
 
     def deselect_country(self, name):
         country = self.world_map.countries[name]
@@ -124,6 +189,7 @@ class GoWhere:
         self.world_map.selected = None
         self.menu.instruction_text = "Make selection"
 
+    @profiler.timed("weak_select_country")
     def weak_select_country(self, name):
         country = self.world_map.countries[name]
         old_country = self.world_map.selected
@@ -134,19 +200,45 @@ class GoWhere:
             self.world_map.selected = country
             self.menu.instruction_text = "Guess country"
 
+    @profiler.timed("strong_select_country")
     def strong_select_country(self, name):
         country = self.world_map.countries[name]
         if country.state in (CountryState.open, CountryState.highlighted, CountryState.guessed):
-            del self.countries_guessed[name]
-            self.menu.add_country_option(name)
-            self.menu.progress = len(self.countries_correct) + len(self.countries_guessed)
+            released_guess = self.session.undo(name)
+            if released_guess is not None:
+                self.menu.add_country_option(released_guess)
+            self.menu.progress = self.session.progress
             # We re-use the weak-select method. First put the country in a state where it can be weak-selected.
             country.state = CountryState.highlighted
             self.weak_select_country(name)
 
 
+def close(root):
+    # Sample the canvas while it still exists, the report itself is written on exit.
+    profiler.snapshot()
+    root.destroy()
+
+
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--profile", metavar="PATH", help="Write a JSON report of timings to PATH on exit.")
+    parser.add_argument("--raster", action="store_true", help="Draw the base map as cached image tiles. Needs Pillow.")
+    parser.add_argument("--low-memory", action="store_true",
+                        help="Release the outlines from memory once drawn, reading them back from the cache as needed.")
+    parser.add_argument("--regions", type=pathlib.Path, default=region_path, help="Shapefile of the regions.")
+    parser.add_argument("--schema", type=pathlib.Path, default=country_schema_path,
+                        help="Country schema of the regions, from tools/create_layout_schema.py.")
+    parser.add_argument("--topology", type=pathlib.Path, default=topology_path,
+                        help="Shared-border topology of the regions, from tools/create_topology.py.")
+    args = parser.parse_args()
+    profiler.configure(args.profile)
+
     root = ttk.Tk()
     root.geometry("1000x600")
-    gowhere = GoWhere(root, regions, country_schema, style_schema)
+    root.protocol("WM_DELETE_WINDOW", lambda: close(root))
+    with profiler.phase("gowhere"):
+        gowhere = GoWhere(root, read_valid_countries(args.schema), raster=args.raster,
+                          retain_geometry=not args.low_memory)
+    # The window and menu are shown while the map loads.
+    gowhere.load_map_in_background(functools.partial(load_resources, args.regions, args.schema, args.topology))
     root.mainloop()
@@ -10,6 +10,7 @@ class Menu:
         self._score = 0
         self._progress = 0
         self._all_names = country_names
+        self._country_name = ""
         
         self._user_entry_text = ttk.StringVar()
         self._country_text = ttk.StringVar()
@@ -25,7 +26,7 @@ class Menu:
         # )
         self._user_entry_box = FuzzyAutoComplete(
             master_frame,
-            values=sorted(country_names.to_list()),
+            values=sorted(country_names),
             textvariable=self._user_entry_text,
             width=25,
         )
@@ -77,7 +78,10 @@ class Menu:
         self._progress_text.set(f"Progress: {progress}/{len(self._all_names)}")
         
     def display_country(self, name):
-        self._country_text.set(name)
+        # Hovering calls this on every change of country, skip setting the variable when the text is unchanged.
+        if name != self._country_name:
+            self._country_name = name
+            self._country_text.set(name)
 
     @property
     def instruction_text(self):
@@ -95,9 +99,8 @@ class Menu:
         self._user_entry_box.reset_text()
     
     def remove_country_option(self, name):
-        # self._user_entry_box.set_completion_list(list(set(self._user_entry_box._completion_list) - {name}))
-        self._user_entry_box.all_choices = list(set(self._user_entry_box.all_choices) - {name})
+        self._user_entry_box.remove_choice(name)
 
     def add_country_option(self, name):
-        # self._user_entry_box.set_completion_list(list(set(self._user_entry_box._completion_list) | {name}))
-        self._user_entry_box.all_choices = list(set(self._user_entry_box.all_choices) | ({name} & set(self._all_names)))
+        # Only names from the original list are restored.
+        self._user_entry_box.restore_choice(name)
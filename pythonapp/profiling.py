@@ -0,0 +1,124 @@
+"""Opt-in timing of start-up phases and event handlers, written as a JSON report on exit.
+
+Enable with the GOWHERE_PROFILE environment variable or the ``--profile`` flag of main.py, giving the report path.
+When disabled the hooks only cost an attribute check.
+"""
+
+import atexit
+import bisect
+import contextlib
+import functools
+import json
+import os
+import time
+
+
+# Upper edges of the latency histogram buckets, in milliseconds. The last bucket is unbounded.
+HISTOGRAM_EDGES_MS = (0.1, 0.2, 0.5, 1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)
+# Latency samples kept per event for the percentiles.
+MAX_SAMPLES = 100000
+
+
+class Profiler:
+    def __init__(self):
+        self.enabled = False
+        self.path = None
+        self.phases = {}
+        self.counters = {}
+        self.events = {}
+        self.gauges = {}
+        self.gauge_values = {}
+        self._start = time.perf_counter()
+
+    def configure(self, path):
+        """Start profiling, writing the report to ``path`` on exit. Does nothing if path is empty."""
+        if not path or self.enabled:
+            return
+        self.enabled = True
+        self.path = path
+        atexit.register(self.write)
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        """Time a block of work. Repeated phases with the same name accumulate."""
+        if not self.enabled:
+            yield
+            return
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            phase = self.phases.setdefault(name, {"seconds": 0.0, "calls": 0})
+            phase["seconds"] += time.perf_counter() - start
+            phase["calls"] += 1
+
+    def timed(self, name):
+        """Decorator recording the latency of every call of an event handler."""
+        def decorator(func):
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                if not self.enabled:
+                    return func(*args, **kwargs)
+                start = time.perf_counter()
+                try:
+                    return func(*args, **kwargs)
+                finally:
+                    self.record(name, time.perf_counter() - start)
+            return wrapper
+        return decorator
+
+    def record(self, name, seconds):
+        event = self.events.setdefault(name, {"samples": [], "histogram": [0] * (len(HISTOGRAM_EDGES_MS) + 1)})
+        milliseconds = seconds * 1000
+        event["histogram"][bisect.bisect_left(HISTOGRAM_EDGES_MS, milliseconds)] += 1
+        if len(event["samples"]) < MAX_SAMPLES:
+            event["samples"].append(milliseconds)
+
+    def count(self, name, n=1):
+        if self.enabled:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def add_gauge(self, name, func):
+        """Register a function sampled by ``snapshot``, e.g. the number of canvas items."""
+        self.gauges[name] = func
+
+    def snapshot(self):
+        """Sample the gauges. Values which cannot be sampled, e.g. of destroyed widgets, keep their last sample."""
+        if not self.enabled:
+            return
+        for name, func in self.gauges.items():
+            try:
+                self.gauge_values[name] = func()
+            except Exception:
+                pass
+
+    def report(self):
+        events = {}
+        for name, event in self.events.items():
+            samples = sorted(event["samples"])
+            events[name] = {
+                "count": sum(event["histogram"]),
+                "mean_ms": sum(samples) / len(samples) if samples else None,
+                "p50_ms": samples[len(samples) // 2] if samples else None,
+                "p99_ms": samples[min(len(samples) - 1, int(len(samples) * 0.99))] if samples else None,
+                "max_ms": samples[-1] if samples else None,
+                "histogram_edges_ms": list(HISTOGRAM_EDGES_MS),
+                "histogram": event["histogram"],
+            }
+        self.snapshot()
+        return {
+            "wall_seconds": time.perf_counter() - self._start,
+            "phases": self.phases,
+            "counters": self.counters,
+            "gauges": self.gauge_values,
+            "events": events,
+        }
+
+    def write(self, path=None):
+        path = path or self.path
+        with open(path, "w") as f:
+            json.dump(self.report(), f, indent=2)
+
+
+profiler = Profiler()
+profiler.configure(os.environ.get("GOWHERE_PROFILE"))
@@ -0,0 +1,166 @@
+"""Local quiz server: many players' games at once over sockets, on the rules of the game module.
+
+Each connection plays one game. Requests and replies are JSON objects, one per line:
+
+    {"op": "countries"}                                 {"countries": [...]}
+    {"op": "guess", "country": "France", "name": "…"}   {"ok": true, "progress": 1}
+    {"op": "undo", "country": "France"}                 {"released": "…", "progress": 0}
+    {"op": "verify"}                                    {"correct": [...], "incorrect": [[country, guess], ...],
+                                                         "score": 1, "progress": 1, "finished": false}
+    {"op": "reset"}                                     {"ok": true}
+
+A request which cannot be served gets {"error": "..."} and the game carries on. Guesses must be country names, so a
+session only holds the small arrays of its GameSession. Every session shares one read-only GameSchema, with its index
+of names.
+
+    python pythonapp/server.py --port 8765
+
+See benchmarks/quiz_load.py for a load test.
+"""
+
+import argparse
+import asyncio
+import json
+import pathlib
+
+from game import GameSchema, GameSession
+from profiling import profiler
+
+
+root_path = pathlib.Path(__file__).resolve().parents[1]
+country_schema_path = root_path / "resources" / "country_schema.npz"
+# Connections waiting to be accepted. Load tests open thousands at once.
+BACKLOG = 4096
+
+
+def raise_open_file_limit():
+    """Raise the soft limit of open files to the hard limit, one being needed per connection. POSIX only."""
+    try:
+        import resource
+    except ImportError:
+        return
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if hard == resource.RLIM_INFINITY or soft < hard:
+        try:
+            resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+        except (ValueError, OSError):
+            pass
+
+
+def load_schema(country_schema_path=country_schema_path):
+    from layout_schema import read_country_schema
+
+    return GameSchema.from_country_schema(read_country_schema(country_schema_path))
+
+
+async def read_line(reader):
+    """The next line from a stream, or b"" at its end. A line longer than the stream's limit is skipped up to its end
+    and raises ValueError, so the stream stays at the start of a line.
+    """
+    try:
+        return await reader.readuntil(b"\n")
+    except asyncio.IncompleteReadError as error:
+        return error.partial
+    except asyncio.LimitOverrunError as error:
+        consumed = error.consumed
+    while True:
+        try:
+            await reader.readexactly(consumed)
+            await reader.readuntil(b"\n")
+            break
+        except asyncio.LimitOverrunError as error:
+            consumed = error.consumed
+        except asyncio.IncompleteReadError:
+            break
+    raise ValueError("Request is too long")
+
+
+class QuizServer:
+    def __init__(self, schema):
+        self.schema = schema
+        self.valid_countries = [name for name, disputed in zip(schema.countries, schema.disputed) if not disputed]
+        self.n_sessions = 0
+
+    def _country(self, request, key="country"):
+        name = request.get(key)
+        if not isinstance(name, str) or name not in self.schema.index:
+            raise ValueError(f"Unknown {key} {name!r}")
+        return name
+
+    @profiler.timed("server_request")
+    def handle(self, session, request):
+        """Apply a request to a session, returning the reply."""
+        op = request.get("op")
+        if op == "guess":
+            country, name = self._country(request), self._country(request, "name")
+            return {"ok": session.guess(country, name), "progress": session.progress}
+        if op == "undo":
+            return {"released": session.undo(self._country(request)), "progress": session.progress}
+        if op == "verify":
+            correct, incorrect = session.verify()
+            return {
+                "correct": correct,
+                "incorrect": incorrect,
+                "score": session.score,
+                "progress": session.progress,
+                "finished": session.finished,
+            }
+        if op == "reset":
+            session.reset()
+            return {"ok": True}
+        if op == "countries":
+            return {"countries": self.valid_countries}
+        raise ValueError(f"Unknown op {op!r}")
+
+    async def serve_client(self, reader, writer):
+        """Play one game with a connection until it closes."""
+        session = GameSession(self.schema)
+        self.n_sessions += 1
+        profiler.count("server_sessions")
+        try:
+            while True:
+                try:
+                    line = await read_line(reader)
+                    if not line:
+                        break
+                    request = json.loads(line)
+                    if not isinstance(request, dict):
+                        raise ValueError("Request is not an object")
+                    reply = self.handle(session, request)
+                except ValueError as error:
+                    reply = {"error": str(error)}
+                writer.write(json.dumps(reply).encode() + b"\n")
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            self.n_sessions -= 1
+            writer.close()
+
+    async def start(self, host="127.0.0.1", port=0):
+        """Start accepting connections, returning the asyncio server. Port 0 picks a free port."""
+        return await asyncio.start_server(self.serve_client, host, port, backlog=BACKLOG)
+
+
+async def serve(host, port, country_schema_path=country_schema_path):
+    server = await QuizServer(load_schema(country_schema_path)).start(host, port)
+    host, port = server.sockets[0].getsockname()[:2]
+    # The load test reads the port from this line.
+    print(f"Serving on {host}:{port}", flush=True)
+    async with server:
+        await server.serve_forever()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765, help="Port to listen on, 0 for any free port.")
+    parser.add_argument("--schema", type=pathlib.Path, default=country_schema_path)
+    parser.add_argument("--profile", metavar="PATH", help="Write a JSON report of timings to PATH on exit.")
+    args = parser.parse_args()
+    profiler.configure(args.profile)
+    raise_open_file_limit()
+    try:
+        asyncio.run(serve(args.host, args.port, args.schema))
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,58 @@
+"""Point lookup of countries using a uniform grid of ring bounding boxes."""
+
+import collections
+
+import numpy as np
+
+
+def point_in_ring(ring, x, y):
+    """Even-odd test of whether (x, y) is inside a closed ring of shape (n, 2)."""
+    x0, y0 = ring[:-1, 0], ring[:-1, 1]
+    x1, y1 = ring[1:, 0], ring[1:, 1]
+    straddles = (y0 > y) != (y1 > y)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        x_cross = x0 + (y - y0) * (x1 - x0) / (y1 - y0)
+    return bool(np.count_nonzero(straddles & (x < x_cross)) % 2)
+
+
+class RingGrid:
+    def __init__(self, coords, ring_offsets, owners, cell_size=20.0):
+        """Index rings, ring i being ``coords[ring_offsets[i]:ring_offsets[i + 1]]`` and belonging to owners[i], on a
+        grid with square cells of ``cell_size``.
+
+        Owners are integers, higher owners being on top of lower ones. The rings are read from ``coords`` when hit
+        tested rather than copied, so it may be a memory-mapped array.
+        """
+        self.coords = coords
+        self.ring_offsets = np.asarray(ring_offsets, dtype=np.int64)
+        self.owners = np.asarray(owners, dtype=np.int64)
+        self.cell_size = cell_size
+        starts, stops = self.ring_offsets[:-1], self.ring_offsets[1:]
+        self.bounds = np.zeros((len(starts), 4))
+        if len(coords):
+            # Bounds of every ring at once, rings being contiguous runs of vertices.
+            non_empty = starts < stops
+            for axis in (0, 1):
+                self.bounds[non_empty, axis] = np.minimum.reduceat(coords[:, axis], starts[non_empty])
+                self.bounds[non_empty, axis + 2] = np.maximum.reduceat(coords[:, axis], starts[non_empty])
+        self.cells = collections.defaultdict(list)
+        cell_bounds = np.floor(self.bounds / cell_size).astype(int)
+        for i, (cx0, cy0, cx1, cy1) in enumerate(cell_bounds.tolist()):
+            for cx in range(cx0, cx1 + 1):
+                for cy in range(cy0, cy1 + 1):
+                    self.cells[cx, cy].append(i)
+
+    def find(self, x, y):
+        """Return the top-most owner whose rings contain (x, y), or None."""
+        candidates = self.cells.get((int(np.floor(x / self.cell_size)), int(np.floor(y / self.cell_size))), ())
+        # An owner contains the point if it is inside an odd number of its rings, so holes are handled.
+        inside = collections.Counter()
+        for i in candidates:
+            x0, y0, x1, y1 = self.bounds[i]
+            if x0 <= x <= x1 and y0 <= y <= y1 and point_in_ring(
+                    np.asarray(self.coords[self.ring_offsets[i]:self.ring_offsets[i + 1]], dtype=float), x, y):
+                inside[int(self.owners[i])] += 1
+        hits = [owner for owner, count in inside.items() if count % 2]
+        if not hits:
+            return None
+        return max(hits)
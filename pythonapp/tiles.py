@@ -0,0 +1,189 @@
+"""Raster tiles of the base map, so zooming and panning do not depend on the complexity of the outlines.
+
+The base map is every country in its base state (open, verified or disputed) rasterised into square tiles for each
+zoom step. Tiles are cached in a bounded LRU and a worker thread prerenders the neighbouring zoom steps. Countries in
+the other states are drawn on top as vector items by WorldMap.
+
+Needs Pillow, which is only imported when a TileRenderer is created, so the vector map works without it.
+"""
+
+import collections
+import math
+import threading
+
+import numpy as np
+
+from profiling import profiler
+import utils
+
+
+TILE_SIZE = 256
+# Tiles kept in memory. At 256x256 RGB this is about 200 kB per tile.
+MAX_TILES = 256
+
+
+def zoom_step(imscale, delta=0.75):
+    """Integer zoom step of a scale, as reached by ZoomFrame.wheel multiplying by ``delta``."""
+    return round(math.log(imscale) / math.log(delta))
+
+
+def step_scale(step, delta=0.75):
+    return delta ** step
+
+
+class TileRenderer:
+    def __init__(self, geometry, names, bounds, background, max_tiles=MAX_TILES, delta=0.75):
+        """Render tiles of the countries ``names``, in drawing order, with unscaled ``bounds`` (n, 4).
+
+        Call ``set_styles`` with the base style of every country before rendering.
+        """
+        try:
+            from PIL import Image, ImageDraw
+        except ImportError as e:
+            raise ImportError("The raster map needs Pillow, install it with 'pip install pillow'") from e
+
+        self._image = Image
+        self._draw = ImageDraw
+        self.geometry = geometry
+        self.names = list(names)
+        self.bounds = np.asarray(bounds, dtype=float)
+        self.background = background
+        self.max_tiles = max_tiles
+        self.delta = delta
+        self._styles = [None] * len(self.names)
+        self.version = 0
+        self._cache = collections.OrderedDict()
+        self._lock = threading.Lock()
+        # Tiles to prerender, replaced by every call of ``prerender``. The worker waits on ``_wake`` when there are none.
+        self._pending = collections.deque()
+        self._wake = threading.Condition(self._lock)
+        self._worker = threading.Thread(target=self._prerender, daemon=True)
+        self._worker.start()
+
+    def set_styles(self, styles):
+        """Set the base Style of every country, dropping the cached tiles if any changed."""
+        styles = list(styles)
+        with self._lock:
+            if styles == self._styles:
+                return
+            self._styles = styles
+            self.version += 1
+            self._cache.clear()
+
+    def tile_bounds(self, step, tx, ty):
+        """Unscaled bounds of a tile."""
+        scale = step_scale(step, self.delta)
+        return np.array((tx, ty, tx + 1, ty + 1), dtype=float) * TILE_SIZE / scale
+
+    def tiles_for(self, step, view):
+        """Keys (step, tx, ty) of the tiles covering unscaled bounds ``view`` at a zoom step."""
+        scale = step_scale(step, self.delta)
+        tx0, ty0, tx1, ty1 = np.floor(np.asarray(view) * scale / TILE_SIZE).astype(int)
+        return [(step, tx, ty) for tx in range(tx0, tx1 + 1) for ty in range(ty0, ty1 + 1)]
+
+    def get(self, key):
+        """Return the image of a tile, rendering it now if it is not cached."""
+        with self._lock:
+            image = self._cache.get(key)
+            if image is not None:
+                self._cache.move_to_end(key)
+                return image
+            version, styles = self.version, self._styles
+        image = self.render(key, styles)
+        self._store(key, image, version)
+        return image
+
+    def prerender(self, keys):
+        """Render tiles in the background, in order. Tiles queued by earlier calls and not rendered yet are dropped,
+        being near views which have since been left.
+        """
+        with self._wake:
+            self._pending = collections.deque(keys)
+            self._wake.notify()
+
+    def _store(self, key, image, version):
+        with self._lock:
+            # Drop renders started before the styles changed.
+            if version != self.version:
+                return
+            self._cache[key] = image
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.max_tiles:
+                self._cache.popitem(last=False)
+
+    def _prerender(self):
+        while True:
+            with self._wake:
+                while not self._pending:
+                    self._wake.wait()
+                key = self._pending.popleft()
+                if key in self._cache:
+                    continue
+                version, styles = self.version, self._styles
+            self._store(key, self.render(key, styles), version)
+
+    def render(self, key, styles):
+        """Rasterise a tile from the given base styles. Safe to call from any thread."""
+        step, tx, ty = key
+        scale = step_scale(step, self.delta)
+        x0, y0, x1, y1 = self.tile_bounds(step, tx, ty)
+        image = self._image.new("RGB", (TILE_SIZE, TILE_SIZE), self.background)
+        draw = self._draw.Draw(image)
+        level = self.geometry.lod_level(scale)
+        intersects = (
+            (self.bounds[:, 0] <= x1) & (self.bounds[:, 2] >= x0)
+            & (self.bounds[:, 1] <= y1) & (self.bounds[:, 3] >= y0)
+        )
+        offset = np.array((tx, ty), dtype=float) * TILE_SIZE
+        for i in np.flatnonzero(intersects):
+            style = styles[i]
+            if style is None:
+                continue
+            # Transform all the rings of the country at once, then draw them from slices of one flat list.
+            coords, ring_offsets = self.geometry.country_coords(self.names[i], level)
+            xy = utils.screen_to_canvas(np.asarray(coords), scale, -offset).ravel().tolist()
+            ring_offsets = (2 * ring_offsets).tolist()
+            for start, stop in zip(ring_offsets[:-1], ring_offsets[1:]):
+                draw.polygon(xy[start:stop], fill=style.fill, outline=style.outline)
+        return image
+
+
+class TileLayer:
+    def __init__(self, canvas, renderer, photo_image=None):
+        """Tiles of ``renderer`` placed on ``canvas`` as image items tagged "tile", below every other item.
+
+        ``photo_image`` converts a PIL image for the canvas, by default ImageTk.PhotoImage.
+        """
+        if photo_image is None:
+            from PIL import ImageTk
+            photo_image = ImageTk.PhotoImage
+        self.canvas = canvas
+        self.renderer = renderer
+        self.photo_image = photo_image
+        # Canvas item and PhotoImage of each placed tile. The PhotoImage must be kept alive while it is shown.
+        self.items = {}
+        self._version = renderer.version
+
+    def clear(self):
+        """Delete the tile items, e.g. once the zoom changed and they no longer fit."""
+        self.canvas.delete("tile")
+        self.items = {}
+
+    @profiler.timed("update_tiles")
+    def update(self, view, imscale, origin):
+        """Show the tiles covering unscaled bounds ``view`` and queue the tiles of the neighbouring zoom steps."""
+        if self.renderer.version != self._version:
+            self._version = self.renderer.version
+            self.clear()
+        step = zoom_step(imscale, self.renderer.delta)
+        keys = self.renderer.tiles_for(step, view)
+        for key in set(self.items) - set(keys):
+            self.canvas.delete(self.items.pop(key)[0])
+        new_keys = [key for key in keys if key not in self.items]
+        for key in new_keys:
+            x, y = utils.screen_to_canvas(self.renderer.tile_bounds(*key)[:2], imscale, origin)
+            photo = self.photo_image(self.renderer.get(key))
+            self.items[key] = (self.canvas.create_image(x, y, image=photo, anchor="nw", tags="tile"), photo)
+        if new_keys:
+            self.canvas.tag_lower("tile")
+            self.renderer.prerender(self.renderer.tiles_for(step - 1, view) + self.renderer.tiles_for(step + 1, view))
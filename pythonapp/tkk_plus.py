@@ -5,9 +5,15 @@ https://stackoverflow.com/a/71380238
 import tkinter as tk
 
 import numpy as np
-import pandas as pd
-from thefuzz import fuzz
 
+from fuzzy_match import FuzzyMatcher
+from profiling import profiler
+from utils import FRAME_MS
+
+
+# Wheel notches allowed either side of the initial scale, zooming out (positive) or in (negative).
+# Wheel notches are accumulated and applied at most once per frame, every FRAME_MS.
+ZOOM_STEP_LIMITS = (-12, 12)
 
 class AutoScrollbar(tk.Scrollbar):
     ''' A scrollbar that hides itself if it's not needed.
@@ -40,8 +46,8 @@ class ZoomFrame(tk.Frame):
         self.canvas = tk.Canvas(self, highlightthickness=0,
                                 xscrollcommand=hbar.set, yscrollcommand=vbar.set)
         self.canvas.grid(row=0, column=0, sticky='nswe')
-        vbar.configure(command=self.canvas.yview)  # bind scrollbars to the canvas
-        hbar.configure(command=self.canvas.xview)
+        vbar.configure(command=self.yview)  # bind scrollbars to the canvas
+        hbar.configure(command=self.xview)
         # # Make the canvas expandable
         self.rowconfigure(0, weight=1)
         self.columnconfigure(0, weight=1)
@@ -51,54 +57,153 @@ class ZoomFrame(tk.Frame):
         self.canvas.bind('<MouseWheel>', self.wheel)  # with Windows and MacOS, but not Linux
         self.canvas.bind('<Button-5>', self.wheel)  # only with Linux, wheel scroll down
         self.canvas.bind('<Button-4>', self.wheel)  # only with Linux, wheel scroll up
+        self.canvas.bind('<Configure>', lambda _: self.view_changed(), add='+')
 
         self.imscale = 1.0
+        # imscale is always delta ** zoom_step, so repeated zooming does not drift.
+        self.zoom_step = 0
+        self.zoom_step_limits = ZOOM_STEP_LIMITS
+        # Zoom waiting for apply_zoom: the target step and the affine map (scale, translation) of canvas coordinates.
+        self._target_step = 0
+        self._pending_zoom = (1.0, np.zeros(2))
+        self._zoom_id = None
+        # Canvas coordinates of the unscaled origin. Together with imscale this maps unscaled item coordinates to
+        # the current canvas coordinates, so items created after zooming can be placed consistently.
+        self.origin = np.array((0.0, 0.0))
         self.imageid = None
         self.delta = 0.75
+        # Called with (imscale, origin) after every zoom.
+        self.zoom_callbacks = []
+        # Called after anything which changes the visible part of the canvas: zoom, pan, scroll or resize.
+        self.view_callbacks = []
+        # Unscaled bounds (x0, y0, x1, y1) of the content. Items may be created lazily, so the scroll region
+        # cannot be taken from the items on the canvas.
+        self.extent = None
 
         # # Text is used to set proper coordinates to the image. You can make it invisible.
         # self.text = self.canvas.create_text(0, 0, anchor='nw', text='Scroll to zoom')
         self.canvas.configure(scrollregion=self.canvas.bbox('all'))
 
+    def set_extent(self, extent):
+        """Set the unscaled bounds of the content, used for the scroll region."""
+        self.extent = np.asarray(extent, dtype=float)
+        self.update_scrollregion()
+
+    def update_scrollregion(self):
+        if self.extent is None:
+            self.canvas.configure(scrollregion=self.canvas.bbox('all'))
+        else:
+            scrollregion = self.extent * self.imscale + np.tile(self.origin, 2)
+            self.canvas.configure(scrollregion=tuple(scrollregion.tolist()))
+
+    def view_changed(self):
+        for callback in self.view_callbacks:
+            callback()
+
+    def xview(self, *args):
+        self.canvas.xview(*args)
+        self.view_changed()
+
+    def yview(self, *args):
+        self.canvas.yview(*args)
+        self.view_changed()
+
     def move_from(self, event):
         ''' Remember previous coordinates for scrolling with the mouse '''
         self.canvas.scan_mark(event.x, event.y)
 
+    @profiler.timed("pan")
     def move_to(self, event):
         ''' Drag (move) canvas to the new position '''
         self.canvas.scan_dragto(event.x, event.y, gain=1)
+        self.view_changed()
 
+    @profiler.timed("wheel")
     def wheel(self, event):
-        ''' Zoom with mouse wheel '''
-        scale = 1.0
+        ''' Zoom with mouse wheel. A burst of notches is applied once, in the next frame, by apply_zoom '''
         # Respond to Linux (event.num) or Windows (event.delta) wheel event
-        if event.num == 5 or event.delta == -120:
-            scale        *= self.delta
-            self.imscale *= self.delta
-        if event.num == 4 or event.delta == 120:
-            scale        /= self.delta
-            self.imscale /= self.delta
-        # Rescale all canvas objects
-        x = self.canvas.canvasx(event.x)
-        y = self.canvas.canvasy(event.y)
-        self.canvas.scale('all', x, y, scale, scale)
-        self.canvas.configure(scrollregion=self.canvas.bbox('all'))
+        if event.num == 5:
+            notches = 1
+        elif event.num == 4:
+            notches = -1
+        else:
+            notches = -round(event.delta / 120)
+        low, high = self.zoom_step_limits
+        step = min(max(self._target_step + notches, low), high)
+        if step == self._target_step:
+            return
+        scale = self.delta ** (step - self._target_step)
+        self._target_step = step
+        # Compose the zoom about the cursor with the pending one: v -> p + scale * (v - p).
+        anchor = np.array((self.canvas.canvasx(event.x), self.canvas.canvasy(event.y)))
+        pending_scale, translation = self._pending_zoom
+        self._pending_zoom = (pending_scale * scale, scale * translation + (1 - scale) * anchor)
+        if self._zoom_id is None:
+            self._zoom_id = self.canvas.after(FRAME_MS, self.apply_zoom)
+
+    @profiler.timed("zoom")
+    def apply_zoom(self):
+        ''' Rescale all canvas objects for the wheel notches since the last frame '''
+        if self._zoom_id is not None:
+            self.canvas.after_cancel(self._zoom_id)
+            self._zoom_id = None
+        scale, translation = self._pending_zoom
+        self._pending_zoom = (1.0, np.zeros(2))
+        if self._target_step == self.zoom_step:
+            # Zoomed in and out again, possibly about different points.
+            scale = 1.0
+            if translation.any():
+                self.canvas.move('all', *translation.tolist())
+        else:
+            # The fixed point of v -> scale * v + translation.
+            x, y = translation / (1 - scale)
+            self.canvas.scale('all', x, y, scale, scale)
+        self.zoom_step = self._target_step
+        self.imscale = self.delta ** self.zoom_step
+        self.origin = scale * self.origin + translation
+        for callback in self.zoom_callbacks:
+            callback(self.imscale, self.origin)
+        self.update_scrollregion()
+        self.view_changed()
 
 class FuzzyAutoComplete(tk.Entry):
-    def __init__(self, parent, values, textvariable, width):
+    def __init__(self, parent, values, textvariable, width, max_choices=20, debounce_ms=50):
         super().__init__(parent, textvariable=textvariable, width=width)
         self.parent = parent
         self.entry_variable = textvariable
+        self.max_choices = max_choices
+        # Rank once after a burst of typing, rather than on every key.
+        self.debounce_ms = debounce_ms
+        self._pending_rank = None
 
-        self.remaining_choices = values
-        self.all_choices = values
+        self._matcher = FuzzyMatcher(values)
         self._index = 0
         self.typed_text = ""
+        self._ranked_text = ""
 
         self.bind("<KeyRelease>", self.autocomplete)
         self.bind("<Tab>", lambda _: self.scroll_through_choices(1))
         self.bind("<Shift-KeyPress-Tab>", lambda _: self.scroll_through_choices(-1))
 
+    @property
+    def all_choices(self):
+        return list(self._matcher.store)
+
+    @all_choices.setter
+    def all_choices(self, values):
+        self._matcher.set_choices(values)
+
+    @property
+    def remaining_choices(self):
+        """Best choices for the last ranked text. Cached by the matcher until the text or the choices change."""
+        return self._matcher.top_k(self._ranked_text, self.max_choices)
+
+    def remove_choice(self, name):
+        self._matcher.store.remove(name)
+
+    def restore_choice(self, name):
+        self._matcher.store.restore(name)
+
     @property
     def index(self):
         return self._index
@@ -106,7 +211,7 @@ class FuzzyAutoComplete(tk.Entry):
     @index.setter
     def index(self, index):
         """Index of 0 means the text entry. Index bigger than 0 corresponds to remaining_choices[index - 1]."""
-        index = np.clip(index, 0, len(self.remaining_choices) + 1)
+        index = np.clip(index, 0, len(self.remaining_choices))
         if index == 0:
             self["state"] = "normal"
             self.entry_variable.set(self.typed_text)
@@ -117,24 +222,29 @@ class FuzzyAutoComplete(tk.Entry):
         self._index = index
 
     def scroll_through_choices(self, step):
+        self.flush()
         self.index += step
 
+    @profiler.timed("autocomplete")
     def autocomplete(self, event):
         """Autocomplete the Combobox."""
         if self["state"] == "disabled":
             return
         # Store in case we move in and out of list.
         self.typed_text = self.entry_variable.get()
-        entry_lower = self.typed_text.lower()
-        results = pd.Series([
-            max(
-                fuzz.partial_ratio(entry_lower, c.lower()),
-                fuzz.ratio(entry_lower, c.lower()[:len(entry_lower)])
-            )
-            for c in self.remaining_choices
-        ], index=self.remaining_choices,
-        )
-        self.remaining_choices = results.sort_values(ascending=False).index.tolist()
+        if self._pending_rank is not None:
+            self.after_cancel(self._pending_rank)
+        self._pending_rank = self.after(self.debounce_ms, self.flush)
+
+    @profiler.timed("autocomplete_rank")
+    def flush(self):
+        """Rank the choices against the typed text now, if a ranking is pending."""
+        if self._pending_rank is None:
+            return
+        self.after_cancel(self._pending_rank)
+        self._pending_rank = None
+        self._ranked_text = self.typed_text
+        self._matcher.top_k(self._ranked_text, self.max_choices)
 
     def reset_text(self):
         self.entry_variable.set("")
@@ -0,0 +1,176 @@
+"""The shared-border topology of the regions, written by tools/create_topology.py in the manner of TopoJSON.
+
+Neighbouring regions share their common borders rather than each holding a copy. The boundary rings are cut into arcs
+at the junctions where the border between two regions ends, and each unique arc is stored once:
+
+* ``arcs``: int32 array of shape (n_arc_vertices, 2) of quantized coordinates, ``(lon, lat) = q * scale + translate``.
+  They are delta encoded: the first vertex of each arc is stored as is and the others relative to the vertex before.
+* ``arc_offsets``: int64 array of length n_arcs + 1. Arc i is ``arcs[arc_offsets[i]:arc_offsets[i + 1]]``.
+* ``ring_arcs``: int32 array of the arcs making up each ring, in order, ``~i`` being arc i reversed. Each arc starts
+  where the one before it ends, and the last arc ends where the first starts.
+* ``ring_offsets``: int64 array of length n_rings + 1. Ring i is made of the arcs
+  ``ring_arcs[ring_offsets[i]:ring_offsets[i + 1]]``.
+* ``region_offsets``: int64 array of length n_regions + 1. Record j of the shapefile owns rings
+  ``region_offsets[j]:region_offsets[j + 1]``, ordered as by utils.extract_rings.
+
+Simplifying the arcs rather than each region's polygons keeps the borders of neighbours identical at every level of
+detail, and each shared border is simplified and projected once.
+"""
+
+import numpy as np
+
+import utils
+
+
+TOPOLOGY_VERSION = 1
+_ARRAYS = ("arcs", "arc_offsets", "ring_arcs", "ring_offsets", "region_offsets", "scale", "translate")
+
+
+def concat_ranges(starts, stops):
+    """The integers of the ranges ``starts[k]:stops[k]`` one after another, as one array."""
+    starts, stops = np.asarray(starts, dtype=np.int64), np.asarray(stops, dtype=np.int64)
+    lengths = stops - starts
+    return np.repeat(starts - (np.cumsum(lengths) - lengths), lengths) + np.arange(lengths.sum())
+
+
+def delta_encode(values, offsets):
+    """Replace every value but the first of each run ``values[offsets[i]:offsets[i + 1]]`` by its difference from the
+    value before.
+    """
+    deltas = np.array(values, dtype=np.int64)
+    deltas[1:] -= values[:-1]
+    starts = offsets[:-1][offsets[:-1] < offsets[1:]]
+    deltas[starts] = values[starts]
+    return deltas
+
+
+def delta_decode(deltas, offsets):
+    """Invert delta_encode."""
+    values = np.cumsum(deltas, axis=0, dtype=np.int64)
+    lengths = np.diff(offsets)
+    before = np.concatenate((np.zeros((1,) + values.shape[1:], dtype=np.int64), values))[offsets[:-1]]
+    return values - np.repeat(before, lengths, axis=0)
+
+
+def write_topology(path, arrays, input_hash, regions_hash):
+    """Write the topology ``arrays``, see the module docstring, to the npz file ``path``.
+
+    ``arcs`` are given as absolute quantized coordinates. ``regions_hash`` identifies the shapefile, see
+    ``built_from``.
+    """
+    arrays = dict(arrays)
+    arrays["arcs"] = delta_encode(arrays["arcs"], arrays["arc_offsets"]).astype(np.int32)
+    arrays["ring_arcs"] = np.asarray(arrays["ring_arcs"], dtype=np.int32)
+    arrays["regions_hash"] = np.array(regions_hash)
+    utils.write_npz(path, arrays, TOPOLOGY_VERSION, input_hash)
+
+
+def _load(path):
+    return utils.load_npz(path, TOPOLOGY_VERSION, "topology")
+
+
+def read_input_hash(path):
+    """The hash of the inputs the topology was made from, or None if there is no readable topology."""
+    return utils.read_npz_input_hash(path, TOPOLOGY_VERSION, "topology")
+
+
+def regions_hash(region_path):
+    """Hash of the shapefile, with its sidecar files."""
+    return utils.hash_files(utils.shapefile_paths(region_path))
+
+
+def built_from(path, region_path):
+    """Whether there is a readable topology at ``path`` made from the shapefile ``region_path``."""
+    try:
+        with _load(path) as data:
+            return str(data["regions_hash"]) == regions_hash(region_path)
+    except (OSError, ValueError, KeyError):
+        return False
+
+
+class Topology:
+    def __init__(self, path):
+        """Read a topology written by ``write_topology``."""
+        with _load(path) as data:
+            for name in _ARRAYS:
+                setattr(self, name, data[name])
+        self.arcs = delta_decode(self.arcs, self.arc_offsets) * self.scale + self.translate
+        # Projected arcs by simplification tolerance, see ``project``.
+        self._projected = {}
+
+    def simplify(self, tolerance):
+        """The arcs simplified with ``tolerance`` (in degrees), as (coords, arc_offsets).
+
+        Arcs keep their end points, so rings still join up. The arcs of rings which would collapse to fewer than three
+        vertices are kept as they are.
+        """
+        import shapely
+
+        if not tolerance:
+            return self.arcs, self.arc_offsets
+        lines = shapely.linestrings(self.arcs, indices=np.repeat(np.arange(len(self.arc_offsets) - 1),
+                                                                 np.diff(self.arc_offsets)))
+        simplified = shapely.simplify(lines, tolerance, preserve_topology=True)
+        lengths = shapely.get_num_coordinates(simplified)
+        collapsed = self._ring_lengths(lengths) < 4
+        if collapsed.any():
+            # Undo the simplification of every arc of those rings, also for the neighbours sharing them.
+            refs = self.ring_arcs[concat_ranges(self.ring_offsets[:-1][collapsed], self.ring_offsets[1:][collapsed])]
+            keep = np.unique(np.where(refs < 0, ~refs, refs))
+            simplified[keep] = lines[keep]
+            lengths[keep] = shapely.get_num_coordinates(lines[keep])
+        return shapely.get_coordinates(simplified), np.concatenate(([0], np.cumsum(lengths))).astype(np.int64)
+
+    def _ring_lengths(self, arc_lengths):
+        """Number of vertices of every ring, closing vertex included, given the number of vertices of each arc."""
+        # Every arc but the first of a ring starts with the vertex the one before ended with.
+        counts = arc_lengths[np.where(self.ring_arcs < 0, ~self.ring_arcs, self.ring_arcs)] - 1
+        return np.add.reduceat(counts, self.ring_offsets[:-1]) + 1
+
+    def rings(self, regions, coords, arc_offsets):
+        """Rebuild the closed rings of the listed regions from arcs (coords, arc_offsets), e.g. from ``simplify``.
+
+        Returns (coords, ring_offsets, region_offsets) as utils.extract_rings does.
+        """
+        regions = np.asarray(regions, dtype=np.int64)
+        rings = concat_ranges(self.region_offsets[regions], self.region_offsets[regions + 1])
+        refs = self.ring_arcs[concat_ranges(self.ring_offsets[rings], self.ring_offsets[rings + 1])]
+        arcs = np.where(refs < 0, ~refs, refs)
+        forward = refs >= 0
+        starts, stops = arc_offsets[arcs], arc_offsets[arcs + 1]
+        # Each arc after the first of a ring skips its first vertex, the last vertex of the arc before.
+        arcs_per_ring = self.ring_offsets[rings + 1] - self.ring_offsets[rings]
+        first = np.zeros(len(refs), dtype=bool)
+        first[np.cumsum(arcs_per_ring) - arcs_per_ring] = True
+        skip = (~first).astype(np.int64)
+        counts = stops - starts - skip
+        within = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts) + np.repeat(skip, counts)
+        index = np.where(
+            np.repeat(forward, counts), np.repeat(starts, counts) + within, np.repeat(stops, counts) - 1 - within,
+        )
+        ring_lengths = np.add.reduceat(counts, np.flatnonzero(first)) if len(counts) else counts
+        ring_offsets = np.concatenate(([0], np.cumsum(ring_lengths))).astype(np.int64)
+        region_offsets = np.concatenate(([0], np.cumsum(
+            self.region_offsets[regions + 1] - self.region_offsets[regions]))).astype(np.int64)
+        return coords[index], ring_offsets, region_offsets
+
+    def project(self, regions, tolerance=0.0):
+        """Project the rings of the listed regions simplified with ``tolerance``, returning (coords, ring lengths) of
+        each region as GeometryCache._project_batch.
+
+        The simplified and projected arcs are kept for further calls with the same tolerance, see ``forget``.
+        """
+        if tolerance not in self._projected:
+            coords, arc_offsets = self.simplify(tolerance)
+            self._projected[tolerance] = utils.project_rings(coords, dtype=np.float32), arc_offsets
+        coords, ring_offsets, region_offsets = self.rings(regions, *self._projected[tolerance])
+        ring_lengths = np.diff(ring_offsets)
+        vertex_offsets = ring_offsets[region_offsets]
+        return [
+            (coords[vertex_offsets[k]:vertex_offsets[k + 1]], ring_lengths[region_offsets[k]:region_offsets[k + 1]])
+            for k in range(len(regions))
+        ]
+
+    def forget(self, tolerance):
+        """Drop the projected arcs kept by ``project`` for a tolerance."""
+        self._projected.pop(tolerance, None)
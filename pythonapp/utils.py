@@ -1,31 +1,157 @@
-import geopandas as gpd
+import hashlib
+import os
+import pathlib
+
 import numpy as np
-from slugify import slugify
 
 
-def wgs84_to_mercator(v):
+# Latitude where Web Mercator is usually cut off. Clamping avoids the singularity at the poles.
+MAX_LATITUDE = 85.0511287798
+# Milliseconds per frame, the rate at which hover, zoom and other batched updates are applied.
+FRAME_MS = 16
+
+HASH_CHUNK_SIZE = 1 << 20
+
+
+def wgs84_to_mercator(v, max_latitude=MAX_LATITUDE):
     v = np.asarray(v)
     x = v[..., 0]
-    y = np.rad2deg(np.log(np.tan((v[..., 1] / 90 + 1) * np.pi / 4)))
+    latitude = v[..., 1] if max_latitude is None else np.clip(v[..., 1], -max_latitude, max_latitude)
+    y = np.rad2deg(np.log(np.tan((latitude / 90 + 1) * np.pi / 4)))
     return np.stack([x, y], axis=-1)
 
 
 def world_to_screen(canvas, v):
-    return 2 * (v + np.array((180, -90))) * np.array((1.35, -1.35))
+    v = np.asarray(v)
+    # Keep float32 input as float32.
+    dtype = v.dtype if np.issubdtype(v.dtype, np.floating) else float
+    return 2 * (v + np.array((180, -90), dtype=dtype)) * np.array((1.35, -1.35), dtype=dtype)
+
+
+def extract_rings(geometries):
+    """Flatten the boundary rings of (multi)polygons into one ragged array.
+
+    Returns the coordinates of shape (n_vertices, 2), ``ring_offsets`` of length n_rings + 1 and
+    ``geometry_offsets`` of length n_geometries + 1. Ring i is ``coords[ring_offsets[i]:ring_offsets[i + 1]]`` and
+    geometry j owns rings ``geometry_offsets[j]:geometry_offsets[j + 1]``. Rings are ordered as in
+    ``polygon.boundary``, exterior first.
+    """
+    import shapely
+
+    geometries = np.asarray(geometries, dtype=object)
+    polygons, polygon_owner = shapely.get_parts(geometries, return_index=True)
+    rings, ring_polygon = shapely.get_rings(polygons, return_index=True)
+    coords, vertex_ring = shapely.get_coordinates(rings, return_index=True)
+    ring_offsets = np.searchsorted(vertex_ring, np.arange(len(rings) + 1))
+    geometry_offsets = np.searchsorted(polygon_owner[ring_polygon], np.arange(len(geometries) + 1))
+    return coords, ring_offsets, geometry_offsets
+
+
+def project_rings(coords, dtype=np.float64, max_latitude=MAX_LATITUDE):
+    """Project WGS84 coordinates to screen coordinates in one pass. ``dtype`` may be float32 to halve memory."""
+    return world_to_screen(None, wgs84_to_mercator(np.asarray(coords, dtype=dtype), max_latitude))
 
 
 def screen_to_world(canvas, v):
     return v * np.array((360 / canvas.width, -180 / canvas.height)) - np.array((180, -90))
 
 
+def screen_to_canvas(v, imscale, origin):
+    """Apply the zoom of the canvas (see ZoomFrame) to unscaled screen coordinates."""
+    return v * imscale + origin
+
+
+def canvas_to_screen(v, imscale, origin):
+    """Undo the zoom of the canvas, returning unscaled screen coordinates."""
+    return (np.asarray(v) - origin) / imscale
+
+
 def encode_tag(country_name):
     """Return string slugified for tagging."""
+    from slugify import slugify
+
     return slugify(country_name, separator="_")
 
 
-def read_regions(path):
-    regions = gpd.read_file(path)
+def shapefile_paths(path):
+    """The shapefile and its sidecar files, without the documentation files."""
+    path = pathlib.Path(path)
+    return [p for p in sorted(path.parent.glob(path.stem + ".*")) if p.suffix not in (".html", ".txt")]
+
+
+def hash_files(paths, salt=""):
+    """Short sha256 of ``salt`` and the names and contents of the files."""
+    digest = hashlib.sha256(salt.encode())
+    for path in paths:
+        path = pathlib.Path(path)
+        digest.update(path.name.encode())
+        # In chunks, so that large shapefiles are not read into memory.
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b""):
+                digest.update(chunk)
+    return digest.hexdigest()[:16]
+
+
+def tool_input_hash(region_path, tool_path, version, options):
+    """Hash of what a tool makes a file from: the shapefile, the tool itself, the file's format version and the tool's
+    options, a string.
+    """
+    return hash_files(shapefile_paths(region_path) + [pathlib.Path(tool_path)], f"version={version} {options}")
+
+
+def write_npz(path, arrays, version, input_hash):
+    """Write ``arrays`` to the compressed npz file ``path``, with the format version and the hash of the inputs."""
+    arrays = dict(arrays, version=np.array(version), input_hash=np.array(input_hash))
+    # Write to a temporary file first, so that an interrupted write leaves the old file in place.
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as f:
+        np.savez_compressed(f, **arrays)
+    os.replace(tmp_path, path)
+
+
+def load_npz(path, version, kind):
+    """Open an npz file written by ``write_npz``. Raises ValueError if it is not of this version of the format."""
+    data = np.load(path, allow_pickle=False)
+    found = int(data["version"])
+    if found != version:
+        data.close()
+        raise ValueError(f"{path} has {kind} version {found}, expected {version}")
+    return data
+
+
+def read_npz_input_hash(path, version, kind):
+    """The hash of the inputs an npz file was made from, or None if there is no readable file of this version."""
+    try:
+        with load_npz(path, version, kind) as data:
+            return str(data["input_hash"])
+    except (OSError, ValueError, KeyError):
+        return None
+
+
+def iter_region_geometries(path, indexes, batch_size=256):
+    """Yield (indexes, geometries) for the listed records of a shapefile, a batch at a time.
+
+    No attribute columns are read and only one batch of geometries is held at a time, so memory stays bounded however
+    large the file is.
+    """
+    import shapely
+    from pyogrio.raw import read
+
+    indexes = list(indexes)
+    for start in range(0, len(indexes), batch_size):
+        batch = indexes[start:start + batch_size]
+        _, _, wkb, _ = read(path, columns=[], fids=batch)
+        yield batch, shapely.from_wkb(wkb)
+
+
+def read_regions(path, columns=None):
+    """Read the shapefile into a GeoDataFrame, with only the given attribute columns if any."""
+    # Imported here so the app can start from the geometry cache without loading geopandas.
+    import geopandas as gpd
+
+    regions = gpd.read_file(path, columns=columns)
     # Special cases. Split sovereignty.
-    regions.loc[regions["NAME"] == "Palestine", "SOVEREIGNT"] = "Palestine"
+    if {"NAME", "SOVEREIGNT"} <= set(regions.columns):
+        regions.loc[regions["NAME"] == "Palestine", "SOVEREIGNT"] = "Palestine"
 
     return regions
@@ -1,121 +1,454 @@
-import copy
+import collections
 import enum
 import re
+import time
+import types
 
 import numpy as np
-import pandas as pd
-import shapely
 
+from hover import HoverController
+from profiling import profiler
+from spatial_index import RingGrid
+import tiles
 import utils
 
 
 CountryState = enum.Enum("CountryState", "open highlighted selected guessed verified disputed")
+# States drawn into the raster tiles of the base map. Countries in other states are drawn as polygons on top.
+BASE_STATES = frozenset((CountryState.open, CountryState.verified, CountryState.disputed))
+# Background colour, the sea.
+SEA_COLOUR = "#006994"
 
+# Default number of vertices a single country, and the whole map, may draw. None means unlimited.
+# These leave the 50m dataset at full detail and only bite for denser data.
+COUNTRY_VERTEX_BUDGET = 20000
+MAP_VERTEX_BUDGET = 150000
+# Milliseconds spent drawing the countries which came into view before returning to the event loop, about half a frame
+# (see utils.FRAME_MS). The rest are drawn in the following slices, so input is handled while the map fills in.
+DRAW_SLICE_MS = 8
 
-def create_polygon_for_geometry(canvas, geometry, tag, outline, fill, width):
+
+def ring_area(ring):
+    """Area of a closed ring using the shoelace formula."""
+    x, y = ring[:, 0].astype(float), ring[:, 1].astype(float)
+    return abs(np.dot(x, np.roll(y, 1)) - np.dot(y, np.roll(x, 1))) / 2
+
+
+def rings_within_budget(geometry, name, level, budget):
+    """Return the rings of a country at the given level of detail, or coarser, using at most ``budget`` vertices.
+
+    If even the coarsest level is over budget the smallest rings are dropped, always keeping the largest.
+    """
+    for _level in range(level, len(geometry.levels)):
+        rings = geometry.rings(name, _level)
+        if budget is None or sum(len(ring) for ring in rings) <= budget:
+            return rings
+    keep = set()
+    total = 0
+    for i in sorted(range(len(rings)), key=lambda i: ring_area(rings[i]), reverse=True):
+        if keep and total + len(rings[i]) > budget:
+            continue
+        keep.add(i)
+        total += len(rings[i])
+    # Keep the original ring order so that drawing order is unchanged.
+    return [ring for i, ring in enumerate(rings) if i in keep]
+
+
+def create_polygon_for_rings(canvas, rings, tag, outline, fill, width):
     ids = []
-    if isinstance(geometry, shapely.MultiPolygon):
-        polys = geometry.geoms
-    else:
-        polys = [geometry]
-    for poly in polys:
-        boundary = poly.boundary
-        if isinstance(boundary, shapely.MultiLineString):
-            lines = boundary.geoms
-        else:
-            lines = [boundary]
-        for line in lines:
-            _id = canvas.create_polygon(
-                # *utils.world_to_screen(canvas, np.array(line.coords)).flatten(),
-                *utils.world_to_screen(canvas, utils.wgs84_to_mercator(np.array(line.coords))).flatten(),
-                outline=outline,
-                fill=fill,
-                width=width,
-                tags=tag,
-            )
-            ids.append(_id)
+    for ring in rings:
+        # A single flat list avoids unpacking every coordinate as a separate argument.
+        _id = canvas.create_polygon(
+            np.asarray(ring).ravel().tolist(),
+            outline=outline,
+            fill=fill,
+            width=width,
+            tags=tag,
+        )
+        ids.append(_id)
+    profiler.count("canvas_polygons_created", len(ids))
     return ids
 
 
-def substitute_style_schema(country_style, colour_options, country_colour_code):
-    country_style = copy.deepcopy(country_style)
-    for state, state_value in country_style.items():
-        for style_type, style_value in state_value.items():
-            match = re.match(r"(C[A-Z]+)", style_value)
-            if match:
-                country_style[state][style_type] = colour_options[match.group(1)][country_colour_code]
-    return country_style
+Style = collections.namedtuple("Style", "outline fill")
+
+
+class StyleTable:
+    def __init__(self, style_schema):
+        """Resolve the style schema once into an immutable table of Style indexed by (colour code, CountryState).
+
+        Style values matching a colour option, e.g. "CLIGHT", are replaced by that option's colour for each colour code.
+        Raises ValueError if the schema is incomplete.
+        """
+        for key in ("colour_codes", "country_style"):
+            if not isinstance(style_schema.get(key), dict):
+                raise ValueError(f"Style schema has no '{key}' mapping")
+        colour_options = style_schema["colour_codes"]
+        country_style = style_schema["country_style"]
+        codes = None
+        for option, colours in colour_options.items():
+            if codes is not None and set(colours) != codes:
+                raise ValueError(f"Colour option '{option}' defines codes {sorted(colours)}, expected {sorted(codes)}")
+            codes = set(colours)
+        self.codes = frozenset(codes or ())
+
+        table = {}
+        for state in CountryState:
+            if state.name not in country_style:
+                raise ValueError(f"Style schema has no style for state '{state.name}'")
+            style = {}
+            for style_type in Style._fields:
+                value = country_style[state.name].get(style_type)
+                if not isinstance(value, str):
+                    raise ValueError(f"Style of state '{state.name}' has no '{style_type}'")
+                style[style_type] = value
+            for code in self.codes:
+                resolved = {}
+                for style_type, value in style.items():
+                    match = re.match(r"(C[A-Z]+)", value)
+                    if match:
+                        if match.group(1) not in colour_options:
+                            raise ValueError(f"Style of state '{state.name}' uses unknown colour '{match.group(1)}'")
+                        value = colour_options[match.group(1)][code]
+                    resolved[style_type] = value
+                table[code, state] = Style(**resolved)
+        self._table = types.MappingProxyType(table)
+
+    def __getitem__(self, key):
+        """Style for (colour code, CountryState)."""
+        return self._table[key]
+
+    def validate_codes(self, codes):
+        """Raise ValueError if any of the colour codes, e.g. of the country schema, has no styles."""
+        unknown = set(codes) - self.codes
+        if unknown:
+            raise ValueError(f"Unknown colour codes {sorted(unknown)}")
 
 
 class Country:
-    def __init__(self, canvas, tag, name, shape, style_schema, bindings):
-        self._canvas = canvas
-        self.tag = tag
-        self.name = name
-        self.shape = shape
-        self._state = None
-        self.style_schema = style_schema
-        self._draw_shape(canvas, shape, tag, bindings)
-        self.state = CountryState.open
+    __slots__ = ("_map", "index")
+
+    def __init__(self, world_map, index):
+        """A country on the map, a handle on row ``index`` of the tables of ``world_map``.
+
+        The state, style and canvas items of every country are held by the WorldMap in arrays. Setting ``state`` marks
+        the country for restyling, which the map batches, see ``WorldMap.flush_styles``.
+        """
+        self._map = world_map
+        self.index = index
+
+    @property
+    def name(self):
+        return self._map.order[self.index]
+
+    @property
+    def tag(self):
+        return self._map.tags[self.index]
 
     @property
     def state(self):
-        return self._state
+        return CountryState(self._map.states[self.index])
 
     @state.setter
     def state(self, state):
-        self._state = state
-        style = self.style_schema[state.name]
-        self._canvas.itemconfigure(self.tag, outline=style["outline"], fill=style["fill"])
-
-    def _draw_shape(self, canvas, shape, tag, bindings, outline="black", fill="grey", width=1):
-        if not isinstance(shape, pd.Series):
-            shape = pd.Series([shape])
-        for _shape in shape:
-            self._make_polygon(canvas, _shape, tag, bindings, outline, fill, width)
-
-    def _make_polygon(self, canvas, shape, tag, bindings, outline, fill, width):
-        polygon_ids = create_polygon_for_geometry(canvas, shape, tag, outline, fill, width)
-        for _id in polygon_ids:
-            for binding in bindings:
-                # The binding functions take the country name as argument instead of event.
-                # Lists break lambdas (closure) so we make a function to properly convert each function.
-                def get_binding_function(func):
-                    return lambda _: func(self.name)
-                canvas.tag_bind(_id, binding[0], get_binding_function(binding[1]))
-                # canvas.tag_bind(_id, binding[0], binding[1])
+        self._map.set_state(self.index, state)
+
+    @property
+    def style(self):
+        """The Style (outline, fill) of the current state."""
+        return self._map.style(self.index)
 
     def __repr__(self):
         return f"<{type(self)} {self.name}>"
 
 
 class WorldMap:
-    def __init__(self, canvas, regions, country_schema, style_schema, country_bindings):
-        # Background is blue for the sea.
-        canvas.configure(bg="#006994")
+    def __init__(self, canvas, geometry, country_schema, styles, country_bindings,
+                 country_vertex_budget=COUNTRY_VERTEX_BUDGET, map_vertex_budget=MAP_VERTEX_BUDGET, raster=False,
+                 photo_image=None, retain_geometry=True, draw_slice_ms=DRAW_SLICE_MS):
+        """The map of countries on ``canvas``.
+
+        If ``raster`` is true the countries in BASE_STATES are drawn as cached image tiles rather than polygons, see
+        the tiles module. This needs Pillow. ``photo_image`` is passed to tiles.TileLayer.
+
+        If ``retain_geometry`` is false the pages of the geometry cache are released once drawn, so that only the
+        canvas holds the outlines. Redrawing and hit testing then read them back from the cache file.
+
+        Countries are drawn when they come into view, biggest first, in slices of ``draw_slice_ms`` scheduled with
+        ``after``. See draw_pending.
+        """
+        canvas.configure(bg=SEA_COLOUR)
 
         self.canvas = canvas
-        self.regions = regions
-        self.country_schema = country_schema
-        self.style_schema = style_schema
+        self.geometry = geometry
+        self.styles = styles
         self.selected = None
         self.highlighted = None
+        self.country_vertex_budget = country_vertex_budget
+        self.map_vertex_budget = map_vertex_budget
+        self.retain_geometry = retain_geometry
+        self.draw_slice_ms = draw_slice_ms
+        self.imscale = 1.0
+        self.origin = np.array((0.0, 0.0))
+        self.level = self._select_level(self.imscale)
+        # Positions of the countries whose state changed since the last flush of styles to the canvas.
+        self._dirty = set()
+        self._flush_id = None
+        self.tiles = None
 
-        self.countries = {name: Country(
-            canvas,
-            utils.encode_tag(name),
-            name,
-            regions.at[name, "geometry"],
-            substitute_style_schema(style_schema["country_style"],
-                                    style_schema["colour_codes"],
-                                    country_schema.at[name, "colour"]),
-            country_bindings,
-        )
-            # Create countries in rank order, from biggest to smallest. Ensures smaller countries are on the top.
-            for name, row in country_schema.sort_values("order").iterrows()
-        }
-        for country in country_schema.index[country_schema["disputed"]]:
-            self.countries[country].state = CountryState.disputed
+        # One row per country, in rank order from biggest to smallest. Drawing in this order ensures smaller countries
+        # are on the top.
+        country_schema = country_schema.sort_values("order")
+        self.order = country_schema.index.tolist()
+        self.tags = [utils.encode_tag(name) for name in self.order]
+        self.colours = country_schema["colour"].tolist()
+        # CountryState values.
+        self.states = np.where(
+            country_schema["disputed"], CountryState.disputed.value, CountryState.open.value,
+        ).astype(np.int8)
+        # Countries are drawn lazily, only while they are in view. See update_visible. A drawn country owns the
+        # canvas items first_ids[i] to first_ids[i] + item_counts[i] - 1, as Tk numbers new items consecutively.
+        self.first_ids = np.zeros(len(self.order), dtype=np.int64)
+        self.item_counts = np.zeros(len(self.order), dtype=np.int32)
+        # The Style currently on the canvas items of each country, None if it is not drawn.
+        self._applied_styles = [None] * len(self.order)
+        self.countries = {name: Country(self, i) for i, name in enumerate(self.order)}
+
+        # Hit testing is done by the map rather than by binding every polygon, on the rings of the cache itself.
+        with profiler.phase("spatial_index"):
+            arrays = geometry.levels[0]
+            rings_per_country = np.diff(arrays["country_offsets"])
+            positions = [self.countries[name].index for name in geometry.names]
+            self.index = RingGrid(arrays["coords"], arrays["ring_offsets"], np.repeat(positions, rings_per_country))
+        # Unscaled bounds of each country, in drawing order.
+        self.bounds = np.array([
+            (*coords.min(axis=0), *coords.max(axis=0))
+            for coords, _ in (geometry.country_coords(name, 0) for name in self.order)
+        ], dtype=float)
+        self.extent = np.array((*self.bounds[:, :2].min(axis=0), *self.bounds[:, 2:].max(axis=0)))
+        self._drawn = np.zeros(len(self.order), dtype=bool)
+        # Countries which came into view and wait to be drawn, in drawing order.
+        self._pending = collections.deque()
+        self._draw_id = None
+        # Countries which have been shown, as polygons or in the tiles. Hit testing ignores the others, which cannot
+        # be seen yet.
+        self.loaded = np.full(len(self.order), raster)
+        # Countries drawn as polygons when in view: all of them, or in raster mode those not in BASE_STATES.
+        self._vector = np.ones(len(self.order), dtype=bool)
+        if raster:
+            self._vector[:] = False
+            # The style of each country in the tiles. It keeps the last base state while the country is drawn on top.
+            self._tile_colours = {}
+            self._base_styles = [self.tile_style(i) for i in range(len(self.order))]
+            renderer = tiles.TileRenderer(geometry, self.order, self.bounds, SEA_COLOUR)
+            renderer.set_styles(self._base_styles)
+            self.tiles = tiles.TileLayer(canvas, renderer, photo_image)
+        self.hover = HoverController(canvas, self.find)
+        with profiler.phase("bindings"):
+            for sequence, func in country_bindings:
+                self.bind(sequence, func)
+            canvas.bind("<Motion>", self.hover.motion, add="+")
+            canvas.bind("<Leave>", self.hover.leave, add="+")
+        profiler.count("canvas_bindings", 2)
 
         # Zoom in.
         self.canvas.scan_dragto(20, 20, gain=1)
+        self.update_visible()
+
+    def set_state(self, i, state):
+        """Set the CountryState of the country at position ``i``. Its items are restyled by the next flush_styles."""
+        self.states[i] = state.value
+        self._dirty.add(i)
+        if self._flush_id is None:
+            self._flush_id = self.canvas.after_idle(self.flush_styles)
+
+    def style(self, i):
+        """The Style (outline, fill) of the current state of the country at position ``i``."""
+        return self.styles[self.colours[i], CountryState(self.states[i])]
+
+    def tile_style(self, i):
+        """The Style of the country at position ``i`` in hex colours, for the tiles.
+
+        Pillow reads colour names as CSS colours, which differ from the X11 colours of Tk, e.g. "grey" and "green".
+        """
+        style = self.style(i)
+        return Style(*(self._tile_colour(colour) for colour in style))
+
+    def _tile_colour(self, colour):
+        if colour not in self._tile_colours:
+            r, g, b = self.canvas.winfo_rgb(colour)
+            self._tile_colours[colour] = f"#{r >> 8:02x}{g >> 8:02x}{b >> 8:02x}"
+        return self._tile_colours[colour]
+
+    def apply_style(self, i):
+        """Restyle the canvas items of the country at position ``i`` to its state. Returns whether anything changed."""
+        style = self.style(i)
+        if not self.item_counts[i] or style == self._applied_styles[i]:
+            return False
+        self.canvas.itemconfigure(self.tags[i], outline=style.outline, fill=style.fill)
+        self._applied_styles[i] = style
+        return True
+
+    @profiler.timed("flush_styles")
+    def flush_styles(self):
+        """Apply the styles of the countries whose state changed, once per idle cycle.
+
+        A country which changed state and back again, or is not drawn, costs nothing. The rest cost one itemconfigure
+        each. In raster mode a change of base style re-renders the tiles once per flush.
+        """
+        if self._flush_id is not None:
+            self.canvas.after_cancel(self._flush_id)
+            self._flush_id = None
+        dirty, self._dirty = sorted(self._dirty), set()
+        if self.tiles is not None:
+            for i in dirty:
+                self._vector[i] = CountryState(self.states[i]) not in BASE_STATES
+                if not self._vector[i]:
+                    self._base_styles[i] = self.tile_style(i)
+            self.tiles.renderer.set_styles(self._base_styles)
+            # Swaps countries between polygons and tiles, and replaces tiles rendered with old styles.
+            self.update_visible()
+        for i in dirty:
+            if self.apply_style(i):
+                profiler.count("style_updates")
+
+    def bind(self, sequence, func):
+        """Call ``func(name)`` when the event happens on a country.
+
+        "<Enter>" and "<Leave>" are raised by the HoverController when the cursor moves between countries. Other
+        sequences are bound on the canvas and dispatched to the country under the cursor.
+        """
+        if sequence == "<Enter>":
+            self.hover.enter_callbacks.append(func)
+        elif sequence == "<Leave>":
+            self.hover.leave_callbacks.append(func)
+        else:
+            def dispatch(event):
+                name = self.find(event.x, event.y)
+                if name is not None:
+                    func(name)
+            self.canvas.bind(sequence, dispatch, add="+")
+            profiler.count("canvas_bindings")
+
+    def find(self, x, y):
+        """Return the name of the country under the window coordinates (x, y), or None."""
+        canvas_xy = (self.canvas.canvasx(x), self.canvas.canvasy(y))
+        i = self.index.find(*utils.canvas_to_screen(canvas_xy, self.imscale, self.origin))
+        return None if i is None or not self.loaded[i] else self.order[i]
+
+
+    @profiler.timed("set_zoom")
+    def set_zoom(self, imscale, origin):
+        """Follow the zoom of the canvas, swapping the countries to the matching level of detail."""
+        self.imscale = imscale
+        self.origin = np.asarray(origin)
+        level = self._select_level(imscale)
+        if self.tiles is not None:
+            # The tiles were scaled with the rest of the canvas. update_visible places those of the new zoom step.
+            self.tiles.clear()
+        if level == self.level:
+            return
+        self.level = level
+        # Redrawing in order preserves the drawing order, biggest countries first.
+        for i in np.flatnonzero(self.item_counts):
+            self._draw(i)
+        self._release_geometry()
+
+    def visible_bounds(self, margin=0.1):
+        """Unscaled bounds of the visible part of the canvas, grown by a fraction on each side. None if unmapped."""
+        width, height = self.canvas.winfo_width(), self.canvas.winfo_height()
+        if width <= 1 or height <= 1:
+            return None
+        corners = np.array((
+            (self.canvas.canvasx(0), self.canvas.canvasy(0)),
+            (self.canvas.canvasx(width), self.canvas.canvasy(height)),
+        ))
+        (x0, y0), (x1, y1) = utils.canvas_to_screen(corners, self.imscale, self.origin)
+        dx, dy = margin * (x1 - x0), margin * (y1 - y0)
+        return np.array((x0 - dx, y0 - dy, x1 + dx, y1 + dy))
+
+    @profiler.timed("update_visible")
+    def update_visible(self):
+        """Delete the items of the countries which left the view and schedule drawing those which came into it."""
+        view = self.visible_bounds()
+        if view is None:
+            # Wait for the canvas to be mapped, which raises <Configure>.
+            return
+        if self.tiles is not None:
+            self.tiles.update(view, self.imscale, self.origin)
+        visible = self._vector & (
+            (self.bounds[:, 0] <= view[2]) & (self.bounds[:, 2] >= view[0])
+            & (self.bounds[:, 1] <= view[3]) & (self.bounds[:, 3] >= view[1])
+        )
+        for i in np.flatnonzero(self._drawn & ~visible):
+            self._undraw(i)
+            self._drawn[i] = False
+        self._pending = collections.deque(np.flatnonzero(visible & ~self._drawn).tolist())
+        if self._pending and self._draw_id is None:
+            self._draw_id = self.canvas.after(1, self.draw_pending)
+
+    @profiler.timed("draw_pending")
+    def draw_pending(self):
+        """Draw the countries waiting in view, biggest first, for up to ``draw_slice_ms``.
+
+        Those left are drawn by the next call, scheduled with ``after`` so that the event loop handles input and
+        redraws the canvas in between.
+        """
+        if self._draw_id is not None:
+            self.canvas.after_cancel(self._draw_id)
+            self._draw_id = None
+        deadline = time.perf_counter() + self.draw_slice_ms / 1000
+        while self._pending:
+            i = self._pending.popleft()
+            self._draw(i)
+            # Keep the drawing order by moving the new items below the next country drawn after it.
+            above = np.flatnonzero(self._drawn[i + 1:])
+            if len(above):
+                self.canvas.tag_lower(self.tags[i], self.tags[i + 1 + above[0]])
+            self._drawn[i] = True
+            self.loaded[i] = True
+            if time.perf_counter() > deadline:
+                break
+        profiler.count("draw_slices")
+        if self._pending:
+            self._draw_id = self.canvas.after(1, self.draw_pending)
+        else:
+            self._release_geometry()
+
+    def _draw(self, i):
+        """Draw the country at position ``i`` at the current zoom, replacing any existing items, in its style."""
+        self._undraw(i)
+        rings = rings_within_budget(self.geometry, self.order[i], self.level, self.country_vertex_budget)
+        style = self._applied_styles[i] = self.style(i)
+        ids = create_polygon_for_rings(
+            self.canvas,
+            [utils.screen_to_canvas(ring, self.imscale, self.origin) for ring in rings],
+            self.tags[i],
+            outline=style.outline,
+            fill=style.fill,
+            width=1,
+        )
+        if ids:
+            self.first_ids[i] = ids[0]
+        self.item_counts[i] = len(ids)
+
+    def _undraw(self, i):
+        """Delete the canvas items of the country at position ``i``. Its state is kept for when it is drawn again."""
+        if self.item_counts[i]:
+            first = int(self.first_ids[i])
+            self.canvas.delete(*range(first, first + int(self.item_counts[i])))
+        self.item_counts[i] = 0
+        self._applied_styles[i] = None
+
+    def _release_geometry(self):
+        if not self.retain_geometry:
+            self.geometry.release()
+
+    def _select_level(self, imscale):
+        """Level of detail for the zoom, made coarser until the whole map fits in the vertex budget."""
+        level = self.geometry.lod_level(imscale)
+        while (self.map_vertex_budget is not None
+               and level < len(self.geometry.levels) - 1
+               and self.geometry.vertex_count(level) > self.map_vertex_budget):
+            level += 1
+        return level
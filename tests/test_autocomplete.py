@@ -0,0 +1,111 @@
+"""Ranking of FuzzyMatcher and scrolling through the choices of FuzzyAutoComplete, without a display.
+
+    python -m pytest tests
+"""
+
+import pathlib
+import random
+import sys
+
+import pytest
+
+root_path = pathlib.Path(__file__).resolve().parents[1]
+sys.path.append(str(root_path / "pythonapp"))
+sys.path.append(str(root_path / "benchmarks"))
+
+from fuzzy_match import CandidateStore, FuzzyMatcher
+from layout_schema import read_valid_countries
+from recording_canvas import HeadlessAutoComplete, RecordingCanvas
+
+
+COUNTRIES = read_valid_countries(root_path / "resources" / "country_schema.npz")
+
+
+def ranked_by_thefuzz(query, choices, k):
+    """The ranking the matcher replaces: every choice scored with thefuzz, best first, ties in the original order."""
+    fuzz = pytest.importorskip("thefuzz.fuzz")
+    query = query.lower()
+    scores = [
+        max(fuzz.partial_ratio(query, choice.lower()), fuzz.ratio(query, choice.lower()[:len(query)]))
+        for choice in choices
+    ]
+    return [choices[i] for i in sorted(range(len(choices)), key=lambda i: -scores[i])][:k]
+
+
+def random_query(rng):
+    if rng.random() < 0.5:
+        name = rng.choice(COUNTRIES).lower()
+        start = rng.randrange(len(name))
+        return name[start:start + rng.randint(1, 6)]
+    return "".join(rng.choice("abcdefghijklmnopqrstuvwxyz '-") for _ in range(rng.randint(0, 6)))
+
+
+def test_store_remove_restore():
+    store = CandidateStore(["a", "b", "c"])
+    version = store.version
+    store.remove("b")
+    assert list(store) == ["a", "c"] and len(store) == 2 and "b" not in store
+    assert store.version == version + 1
+    # Removing twice, and unknown names, change nothing.
+    store.remove("b")
+    store.remove("z")
+    store.restore("z")
+    assert store.version == version + 1
+    store.restore("b")
+    assert list(store) == ["a", "b", "c"] and len(store) == 3 and "b" in store
+    assert store.version == version + 2
+    store.restore("b")
+    assert store.version == version + 2
+
+
+def test_top_k_matches_thefuzz():
+    rng = random.Random(0)
+    matcher = FuzzyMatcher(COUNTRIES)
+    removed = set()
+    for _ in range(300):
+        if rng.random() < 0.2:
+            name = rng.choice(COUNTRIES)
+            if name in removed:
+                matcher.store.restore(name)
+                removed.discard(name)
+            else:
+                matcher.store.remove(name)
+                removed.add(name)
+        query = random_query(rng)
+        k = rng.choice((1, 5, 20))
+        remaining = [name for name in COUNTRIES if name not in removed]
+        assert matcher.top_k(query, k) == ranked_by_thefuzz(query, remaining, k), (query, k)
+
+
+def test_top_k_reuses_prefixes():
+    matcher = FuzzyMatcher(COUNTRIES)
+    typed = "united k"
+    for end in range(len(typed) + 1):
+        assert matcher.top_k(typed[:end], 20) == ranked_by_thefuzz(typed[:end], COUNTRIES, 20)
+    assert matcher.top_k(typed, 1) == ["United Kingdom"]
+
+
+def test_set_choices_invalidates_results():
+    matcher = FuzzyMatcher(["France", "Finland"])
+    assert matcher.top_k("fra", 1) == ["France"]
+    matcher.set_choices(["Fiji", "Frankonia"])
+    assert matcher.top_k("fra", 1) == ["Frankonia"]
+
+
+def test_tab_past_the_last_choice():
+    canvas = RecordingCanvas()
+    entry = HeadlessAutoComplete(canvas, COUNTRIES)
+    entry.type("fra")
+    canvas.update()
+    choices = entry.remaining_choices
+    assert len(choices) == entry.max_choices
+    for _ in range(len(choices) + 5):
+        entry.scroll_through_choices(1)
+    assert entry.index == len(choices)
+    assert entry.entry_variable.get() == choices[-1]
+    assert entry["state"] == "disabled"
+    for _ in range(len(choices) + 5):
+        entry.scroll_through_choices(-1)
+    assert entry.index == 0
+    assert entry.entry_variable.get() == "fra"
+    assert entry["state"] == "normal"
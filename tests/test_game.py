@@ -0,0 +1,106 @@
+"""Rules of GameSession and the bulk ``replay`` of scripted games.
+
+    python -m pytest tests
+"""
+
+import pathlib
+import random
+import sys
+
+import numpy as np
+
+root_path = pathlib.Path(__file__).resolve().parents[1]
+sys.path.append(str(root_path / "pythonapp"))
+
+from game import GameSchema, GameSession, GameState, replay
+
+
+def schema():
+    return GameSchema(["France", "Spain", "Kosovo", "Peru"], [False, False, True, False])
+
+
+def test_guess_and_undo():
+    session = GameSession(schema())
+    assert session.guess("France", "Spain")
+    assert session.progress == 1
+    assert session.display_name("France") == "Spain"
+    # A country with a guess, or disputed, cannot be guessed, and a guess needs a name.
+    assert not session.guess("France", "France")
+    assert not session.guess("Kosovo", "Kosovo")
+    assert not session.guess("Spain", "")
+    assert session.undo("France") == "Spain"
+    assert session.undo("France") is None
+    assert session.progress == 0
+    assert session.state[0] == GameState.open
+    assert session.display_name("France") == ""
+
+
+def test_verify_scores():
+    session = GameSession(schema())
+    session.guess("France", "France")
+    session.guess("Spain", "Peru")
+    session.guess("Peru", "Atlantis")
+    correct, incorrect = session.verify()
+    assert correct == ["France"]
+    assert incorrect == [("Spain", "Peru"), ("Peru", "Atlantis")]
+    assert session.score == 1 - 2
+    assert session.progress == 1
+    assert session.display_name("France") == "France"
+    # Verified countries stay verified, and cannot be guessed or undone.
+    assert not session.guess("France", "Spain")
+    assert session.undo("France") is None
+    assert session.verify() == ([], [])
+
+    session.guess("Spain", "Spain")
+    session.guess("Peru", "Peru")
+    session.verify()
+    assert session.score == 1
+    assert session.finished
+
+    session.reset()
+    assert (session.score, session.progress, session.finished) == (0, 0, False)
+    assert session.state.tolist() == schema().initial_state.tolist()
+
+
+def random_actions(rng, countries, n):
+    names = countries + ["Atlantis", "Narnia"]
+    actions = []
+    for _ in range(n):
+        roll = rng.random()
+        if roll < 0.6:
+            actions.append(("guess", rng.choice(countries), rng.choice(names)))
+        elif roll < 0.85:
+            # Undo of countries which are open, verified or disputed as well as guessed.
+            actions.append(("undo", rng.choice(countries)))
+        else:
+            actions.append(("verify",))
+    return actions
+
+
+def test_replay_matches_run_script():
+    rng = random.Random(0)
+    game_schema = schema()
+    scripts = []
+    expected = []
+    for _ in range(200):
+        session = GameSession(game_schema)
+        script = session.encode_script(random_actions(rng, game_schema.countries, rng.randint(0, 30)))
+        session.run_script(script)
+        scripts.append(script)
+        expected.append((session.score, session.progress, session.finished))
+    scores, progress, finished = replay(game_schema, scripts)
+    assert list(zip(scores.tolist(), progress.tolist(), finished.tolist())) == expected
+
+
+def test_run_script_matches_session_calls():
+    rng = random.Random(1)
+    game_schema = schema()
+    for _ in range(100):
+        actions = random_actions(rng, game_schema.countries, 20)
+        played = GameSession(game_schema)
+        for action in actions:
+            getattr(played, action[0])(*action[1:])
+        scripted = GameSession(game_schema)
+        scripted.run_script(scripted.encode_script(actions))
+        assert (scripted.score, scripted.progress) == (played.score, played.progress)
+        assert np.array_equal(scripted.state, played.state)
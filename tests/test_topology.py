@@ -0,0 +1,114 @@
+"""Round trip of regions through tools/create_topology.py and pythonapp/topology.py.
+
+    python -m pytest tests
+"""
+
+import pathlib
+import sys
+
+import numpy as np
+import pytest
+import shapely
+
+root_path = pathlib.Path(__file__).resolve().parents[1]
+sys.path.append(str(root_path / "pythonapp"))
+sys.path.append(str(root_path / "tools"))
+
+import topology
+import utils
+from create_topology import build_topology
+
+
+QUANTIZATION = 1000
+
+
+def regions():
+    """Two squares sharing an edge, a square with a hole and the enclave filling it, and a multipolygon of an island
+    and a square touching the second at a corner. Exteriors run anticlockwise and holes clockwise, as in shapefiles.
+    """
+    square = lambda x, y, size=1.0: shapely.box(x, y, x + size, y + size)
+    return np.array([
+        square(0, 0),
+        square(1, 0),
+        shapely.Polygon(square(3, 0, 3).exterior.coords, [square(4, 1).exterior.coords[::-1]]),
+        square(4, 1),
+        shapely.MultiPolygon([square(2, 1), square(0, 4, 0.5)]),
+    ], dtype=object)
+
+
+def same_ring(ring, expected, tolerance):
+    """Whether two closed rings have the same vertices in the same cyclic order, from any starting vertex."""
+    ring, expected = ring[:-1], expected[:-1]
+    if len(ring) != len(expected):
+        return False
+    return any(np.abs(np.roll(ring, -k, axis=0) - expected).max() <= tolerance for k in range(len(ring)))
+
+
+@pytest.fixture
+def written(tmp_path):
+    arrays = build_topology(regions(), QUANTIZATION)
+    path = tmp_path / "topology.npz"
+    topology.write_topology(path, arrays, "inputs", "regions")
+    return arrays, topology.Topology(path)
+
+
+def test_delta_round_trip():
+    offsets = np.array([0, 3, 3, 4, 7])
+    values = np.array([[5, 1], [7, 2], [6, 9], [0, 0], [-3, 4], [8, 8], [2, -6]])
+    deltas = topology.delta_encode(values, offsets)
+    # The first vertex of each run is kept as is, the run at 3 being empty.
+    assert deltas[[0, 3, 4]].tolist() == values[[0, 3, 4]].tolist()
+    assert deltas[1].tolist() == [2, 1]
+    assert topology.delta_decode(deltas, offsets).tolist() == values.tolist()
+
+
+def test_rings_round_trip(written):
+    arrays, read = written
+    coords, ring_offsets, region_offsets = utils.extract_rings(regions())
+    rebuilt, rebuilt_ring_offsets, rebuilt_region_offsets = read.rings(np.arange(5), read.arcs, read.arc_offsets)
+    assert rebuilt_region_offsets.tolist() == region_offsets.tolist()
+    # Within half a grid step of the original vertices.
+    tolerance = float((arrays["scale"] / 2).max()) + 1e-9
+    for i in range(len(ring_offsets) - 1):
+        assert same_ring(
+            rebuilt[rebuilt_ring_offsets[i]:rebuilt_ring_offsets[i + 1]],
+            coords[ring_offsets[i]:ring_offsets[i + 1]],
+            tolerance,
+        ), f"ring {i}"
+
+
+def test_shared_borders_stored_once(written):
+    _, read = written
+    refs = read.ring_arcs
+    arcs = np.where(refs < 0, ~refs, refs)
+    # Each arc is used by at most two rings, once forwards and once reversed when shared.
+    counts = np.bincount(arcs, minlength=len(read.arc_offsets) - 1)
+    assert counts.max() == 2
+    for arc in np.flatnonzero(counts == 2):
+        assert sorted(refs[arcs == arc] >= 0) == [False, True]
+    # The hole and the enclave filling it are one closed arc.
+    hole, enclave = read.region_offsets[2] + 1, read.region_offsets[3]
+    hole_refs = refs[read.ring_offsets[hole]:read.ring_offsets[hole + 1]]
+    enclave_refs = refs[read.ring_offsets[enclave]:read.ring_offsets[enclave + 1]]
+    assert len(hole_refs) == len(enclave_refs) == 1
+    assert hole_refs[0] == ~enclave_refs[0]
+    # Fewer vertices are stored than the rings have, the shared edges being stored once.
+    assert len(read.arcs) < len(utils.extract_rings(regions())[0])
+
+
+def test_simplify_keeps_rings(written):
+    _, read = written
+    coords, arc_offsets = read.simplify(0.5)
+    rebuilt, ring_offsets, _ = read.rings(np.arange(5), coords, arc_offsets)
+    lengths = np.diff(ring_offsets)
+    assert (lengths >= 4).all()
+    # Every ring is closed.
+    assert np.array_equal(rebuilt[ring_offsets[:-1]], rebuilt[ring_offsets[1:] - 1])
+
+
+def test_version_mismatch(tmp_path):
+    path = tmp_path / "topology.npz"
+    utils.write_npz(path, {}, topology.TOPOLOGY_VERSION + 1, "inputs")
+    assert topology.read_input_hash(path) is None
+    with pytest.raises(ValueError):
+        topology.Topology(path)
@@ -1,71 +1,135 @@
-"""Decide which colour to make countries and which territories to hide."""
+"""Decide which colour to make countries and which territories to hide.
 
-import itertools
+Writes resources/country_schema.npz, see pythonapp/layout_schema.py. The rerun is skipped if the shapefile, the
+options and this script, which holds the rules, are unchanged since the schema was written.
+
+Other Natural Earth datasets are grouped by other columns, e.g. for the states and provinces of admin-1, which have no
+7-colour column:
+
+    python tools/create_layout_schema.py --regions ne_10m_admin_1_states_provinces.shp --output admin_1.npz \
+        --group-by name_en --name-columns name_en name --colour-column auto
+"""
+
+import argparse
 import pathlib
 import sys
 
+import numpy as np
 import pandas as pd
-from thefuzz import fuzz
+import shapely
+from rapidfuzz import fuzz, process
 
 root_path = pathlib.Path(__file__).resolve().parents[1]
 sys.path.append(str(root_path / "pythonapp"))
 
+import layout_schema
 import utils
 
 
 resource_path = root_path / "resources"
-region_path = resource_path / "Natural_Earth_quick_start" / "50m_cultural" / "ne_50m_admin_0_countries.shp"
-schema_path = resource_path / "country_schema.csv"
-
-regions = utils.read_regions(region_path)
-
-schema = pd.DataFrame(
-    index=regions["SOVEREIGNT"].unique(),
-    columns=["names", "region_indexes", "colour", "order", "disputed"],
-).rename_axis("country")
-
-# Hide territories which are too small.
-territories_to_country = regions[["NAME", "NAME_LONG"]].groupby(regions["SOVEREIGNT"])
-
-country_area = regions.set_index("SOVEREIGNT")["geometry"].apply(lambda g: g.area)
-global_area = country_area.sum()
-
-for country, territories in territories_to_country:
-    # schema.loc[country, "names"]
-    territories["AREA"] = regions.loc[territories.index, "geometry"].apply(lambda g: g.area)
-    name_candidates = territories[["NAME", "NAME_LONG"]].stack()
-    name_similarity = name_candidates.apply(lambda n: fuzz.ratio(n, country))
-    name_matches = name_candidates[name_similarity.sort_values(ascending=False) > 95]
-    # If we have a really high match name then use this as the main territory.
+region_path = resource_path / "Natural_Earth_50m_cultural" / "ne_50m_admin_0_countries.shp"
+schema_path = resource_path / "country_schema.npz"
+
+DISPUTED = ["Kashmir", "Northern Cyprus", "Western Sahara", "Somaliland"]
+# A territory name scoring above this (0-100) against its country's name makes it the main territory.
+NAME_MATCH_SCORE = 95
+# Territories smaller than both fractions, of the main territory and of the world, are hidden.
+MIN_COUNTRY_FRACTION = 0.05
+MIN_GLOBAL_FRACTION = 1e-4
+# Colour codes used by auto colouring, those of resources/style_schema.yaml.
+N_COLOURS = 7
+
+
+def input_hash(region_path, options):
+    return utils.tool_input_hash(region_path, __file__, layout_schema.SCHEMA_VERSION, f"options={options}")
+
+
+def auto_colours(regions, country, n_colours=N_COLOURS):
+    """Colour codes by country such that touching countries differ where possible, for data without map colours."""
+    geometries = np.asarray(regions.geometry.values)
+    left, right = shapely.STRtree(geometries).query(geometries, predicate="intersects")
+    countries = pd.Index(country.unique())
+    owner = countries.get_indexer(country)
+    neighbours = [set() for _ in countries]
+    for i, j in zip(owner[left], owner[right]):
+        if i != j:
+            neighbours[i].add(j)
+    colours = np.zeros(len(countries), dtype=int)
+    # Colour the countries with the most neighbours first, each with the first colour its neighbours do not use.
+    for i in sorted(range(len(countries)), key=lambda i: -len(neighbours[i])):
+        used = {colours[j] for j in neighbours[i]}
+        colours[i] = next((c for c in range(1, n_colours + 1) if c not in used), 1 + i % n_colours)
+    return pd.Series([f"C{c}" for c in colours], index=countries)
+
+
+def create_schema(regions, group_by="SOVEREIGNT", name_columns=("NAME", "NAME_LONG"), colour_column="MAPCOLOR7"):
+    country = regions[group_by]
+    area = pd.Series(shapely.area(np.asarray(regions.geometry.values)), index=regions.index)
+
+    # Score every territory name against the name of its country in one call.
+    name_candidates = regions[list(name_columns)].stack()
+    candidate_region = name_candidates.index.get_level_values(0)
+    similarity = np.rint(process.cpdist(
+        name_candidates.tolist(), country.loc[candidate_region].tolist(), scorer=fuzz.ratio,
+    ))
+    matches = candidate_region[similarity > NAME_MATCH_SCORE]
+    # If we have a really high match name then use the first such territory as the main territory.
     # Otherwise, use the largest land mass.
-    if len(name_matches) > 0:
-        main_id = name_matches.index.get_level_values(0)[0]
-    else:
-        main_id = None
-
-    areas = territories["AREA"].sort_values(ascending=False)
-    if main_id is None:
-        main_id = areas.index[0]
-
-    country_fraction = areas / areas[main_id]
-    global_fraction = areas / global_area
-    # Discard if < 5% main area and < 1e-4 global
-    territory_discard = (country_fraction < 0.05) & (global_fraction < 1e-4)
-
-    schema.at[country, "region_indexes"] = list(territory_discard[~territory_discard].index)
-    schema.at[country, "names"] = list({country, *territories.loc[main_id, ["NAME", "NAME_LONG"]]})
-    # Natural Earth already contains colours codes where adjacent countries have different colours which are consistent
-    # amongst territories of the same sovereignty.
-    colour_int = regions.loc[territories.index[0], "MAPCOLOR7"]
-    schema.at[country, "colour"] = f"C{colour_int}"
-    schema.at[country, "order"] = areas.sum()
-
-# Mark special cases.
-schema["disputed"] = False
-schema.loc[["Kashmir", "Northern Cyprus", "Western Sahara", "Somaliland"], "disputed"] = True
-schema = schema.drop("Antarctica")
-
-# Larger areas get smaller rank.
-# We will draw the countries in ascending rank order, finishing with the smallest countries.
-schema["order"] = schema["order"].rank(ascending=False).astype(int)
-schema.to_csv(schema_path)
+    main_by_name = pd.Series(matches, index=country.loc[matches].to_numpy()).groupby(level=0).first()
+    main_by_area = area.groupby(country).idxmax()
+    main_id = main_by_name.combine_first(main_by_area).astype(int)
+
+    main_area = area.loc[main_id.loc[country].to_numpy()].to_numpy()
+    territory_discard = (area / main_area < MIN_COUNTRY_FRACTION) & (area / area.sum() < MIN_GLOBAL_FRACTION)
+    # Territories of each country from largest to smallest.
+    kept = area[~territory_discard].sort_values(ascending=False, kind="stable")
+
+    countries = country.unique()
+    main_names = regions.loc[main_id.loc[countries], list(name_columns)].to_numpy()
+    schema = pd.DataFrame({
+        "names": [list(dict.fromkeys((name, *others))) for name, others in zip(countries, main_names)],
+        "region_indexes": kept.index.to_series().groupby(country.loc[kept.index].to_numpy()).agg(list),
+        # Natural Earth already contains colours codes where adjacent countries have different colours which are
+        # consistent amongst territories of the same sovereignty.
+        "colour": (
+            auto_colours(regions, country) if colour_column == "auto"
+            else "C" + regions.groupby(group_by)[colour_column].first().astype(str)
+        ),
+        "order": area.groupby(country).sum(),
+    }, index=pd.Index(countries, name="country"))[["names", "region_indexes", "colour", "order"]]
+
+    # Mark special cases.
+    schema["disputed"] = schema.index.isin(DISPUTED)
+    schema = schema.drop("Antarctica", errors="ignore")
+
+    # Larger areas get smaller rank.
+    # We will draw the countries in ascending rank order, finishing with the smallest countries.
+    schema["order"] = schema["order"].rank(ascending=False).astype(int)
+    return schema
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--regions", type=pathlib.Path, default=region_path, help="Shapefile of the regions.")
+    parser.add_argument("--output", type=pathlib.Path, default=schema_path)
+    parser.add_argument("--group-by", default="SOVEREIGNT", help="Column naming the country of each region.")
+    parser.add_argument("--name-columns", nargs="+", default=["NAME", "NAME_LONG"],
+                        help="Columns of other names, matched against the country to find its main territory.")
+    parser.add_argument("--colour-column", default="MAPCOLOR7",
+                        help="Column of colour codes 1-7, or 'auto' to colour touching countries differently.")
+    parser.add_argument("--force", action="store_true", help="Rebuild even if the inputs are unchanged.")
+    args = parser.parse_args()
+
+    options = (args.group_by, tuple(args.name_columns), args.colour_column)
+    key = input_hash(args.regions, options)
+    if not args.force and layout_schema.read_input_hash(args.output) == key:
+        print(f"{args.output.name} is up to date")
+        sys.exit(0)
+    columns = list(dict.fromkeys([args.group_by, *args.name_columns, "NAME", "SOVEREIGNT"]))
+    if args.colour_column != "auto":
+        columns.append(args.colour_column)
+    # Only the columns used are read. NAME and SOVEREIGNT are for the special cases of read_regions.
+    regions = utils.read_regions(args.regions, columns=columns)
+    schema = create_schema(regions, args.group_by, args.name_columns, args.colour_column)
+    layout_schema.write_country_schema(args.output, schema, key)
+    print(f"Wrote {len(schema)} countries to {args.output.name}")
@@ -0,0 +1,148 @@
+"""Find the borders which neighbouring regions share, so that each is stored, simplified and projected once.
+
+Writes resources/topology.npz, see pythonapp/topology.py, from which the geometry cache is built. The coordinates are
+quantized to a grid of ``--quantization`` steps across the extent of the regions, on which the vertices of shared
+borders coincide. The rerun is skipped if the shapefile, the options and this script are unchanged since the topology
+was written.
+
+    python tools/create_topology.py
+    python tools/create_topology.py --regions ne_10m_admin_0_countries.shp --output topology_10m.npz
+"""
+
+import argparse
+import pathlib
+import sys
+
+import numpy as np
+import shapely
+
+root_path = pathlib.Path(__file__).resolve().parents[1]
+sys.path.append(str(root_path / "pythonapp"))
+
+import topology
+import utils
+
+
+resource_path = root_path / "resources"
+region_path = resource_path / "Natural_Earth_50m_cultural" / "ne_50m_admin_0_countries.shp"
+topology_path = resource_path / "topology.npz"
+
+# Grid steps across the extent of the regions. For the whole world a step is about 40 m, far below a pixel at the
+# deepest zoom.
+QUANTIZATION = 10 ** 6
+
+
+def input_hash(region_path, quantization):
+    return utils.tool_input_hash(region_path, __file__, topology.TOPOLOGY_VERSION, f"quantization={quantization}")
+
+
+def _cyclic_neighbours(ring_offsets):
+    """Indexes of the vertex before and after every vertex, within its ring, of open rings given by offsets."""
+    n = ring_offsets[-1]
+    before, after = np.arange(n) - 1, np.arange(n) + 1
+    starts, stops = ring_offsets[:-1], ring_offsets[1:]
+    before[starts] = stops - 1
+    after[stops - 1] = starts
+    return before, after
+
+
+def _open_rings(keys, ring_offsets):
+    """Drop the closing vertex of every ring and vertices repeating the one before, e.g. after quantization.
+
+    Returns the index of each vertex kept and the offsets of the open rings, without rings of fewer than three.
+    """
+    lengths = np.diff(ring_offsets) - 1
+    index = topology.concat_ranges(ring_offsets[:-1], ring_offsets[:-1] + lengths)
+    offsets = np.concatenate(([0], np.cumsum(lengths)))
+    before, _ = _cyclic_neighbours(offsets)
+    keep = keys[index] != keys[index[before]]
+    # A ring of one repeated vertex keeps none of them.
+    ring = np.repeat(np.arange(len(lengths)), lengths)
+    lengths = np.bincount(ring[keep], minlength=len(lengths))
+    index = index[keep]
+    ring_keep = np.repeat(lengths >= 3, lengths)
+    lengths = np.where(lengths >= 3, lengths, 0)
+    return index[ring_keep], np.concatenate(([0], np.cumsum(lengths))), lengths > 0
+
+
+def build_topology(geometries, quantization=QUANTIZATION):
+    """Cut the boundary rings of the (multi)polygons into arcs at junctions and keep each arc once.
+
+    Returns the arrays of topology.write_topology, with the arcs as absolute quantized coordinates.
+    """
+    coords, ring_offsets, geometry_offsets = utils.extract_rings(geometries)
+    translate = coords.min(axis=0)
+    scale = np.maximum(coords.max(axis=0) - translate, 1e-9) / (quantization - 1)
+    quantized = np.rint((coords - translate) / scale).astype(np.int64)
+    keys = quantized[:, 0] << 32 | quantized[:, 1]
+
+    index, open_offsets, ring_kept = _open_rings(keys, ring_offsets)
+    keys = keys[index]
+    # A vertex is a junction if its occurrences, over all rings, do not all have the same pair of neighbours: a border
+    # shared by two rings leaves one of them there.
+    before, after = _cyclic_neighbours(open_offsets)
+    pairs = np.stack((keys, np.minimum(keys[before], keys[after]), np.maximum(keys[before], keys[after])), axis=1)
+    distinct = np.unique(pairs, axis=0)[:, 0]
+    junction_keys = distinct[1:][distinct[1:] == distinct[:-1]]
+    junctions = np.isin(keys, junction_keys)
+
+    arcs = []
+    arc_ids = {}
+    ring_arcs = []
+    ring_arc_counts = []
+    for start, stop in zip(open_offsets[:-1], open_offsets[1:]):
+        if start == stop:
+            continue
+        ring = np.arange(start, stop)
+        cuts = np.flatnonzero(junctions[start:stop])
+        if not len(cuts):
+            # A ring shared whole, e.g. an enclave and the hole around it, is one closed arc. Start it at its least
+            # vertex so that both copies are cut alike.
+            cuts = np.array((np.argmin(keys[start:stop]),))
+        ring = np.roll(ring, -cuts[0])
+        cuts = np.append(cuts - cuts[0], len(ring))
+        ring = np.append(ring, ring[0])
+        for cut_start, cut_stop in zip(cuts[:-1], cuts[1:]):
+            arc = ring[cut_start:cut_stop + 1]
+            arc_keys = keys[arc]
+            ref = arc_ids.get(arc_keys.tobytes())
+            if ref is None:
+                ref = arc_ids.get(arc_keys[::-1].tobytes())
+                ref = None if ref is None else ~ref
+            if ref is None:
+                ref = arc_ids[arc_keys.tobytes()] = len(arcs)
+                arcs.append(index[arc])
+            ring_arcs.append(ref)
+        ring_arc_counts.append(len(cuts) - 1)
+
+    arc_lengths = [len(arc) for arc in arcs]
+    return {
+        "arcs": quantized[np.concatenate(arcs)] if arcs else np.zeros((0, 2), dtype=np.int64),
+        "arc_offsets": np.concatenate(([0], np.cumsum(arc_lengths))).astype(np.int64),
+        "ring_arcs": np.array(ring_arcs, dtype=np.int32),
+        "ring_offsets": np.concatenate(([0], np.cumsum(ring_arc_counts))).astype(np.int64),
+        "region_offsets": np.concatenate(([0], np.cumsum(ring_kept)))[geometry_offsets].astype(np.int64),
+        "scale": scale,
+        "translate": translate,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--regions", type=pathlib.Path, default=region_path, help="Shapefile of the regions.")
+    parser.add_argument("--output", type=pathlib.Path, default=topology_path)
+    parser.add_argument("--quantization", type=int, default=QUANTIZATION,
+                        help="Grid steps across the extent of the regions.")
+    parser.add_argument("--force", action="store_true", help="Rebuild even if the inputs are unchanged.")
+    args = parser.parse_args()
+
+    key = input_hash(args.regions, args.quantization)
+    if not args.force and topology.read_input_hash(args.output) == key:
+        print(f"{args.output.name} is up to date")
+        sys.exit(0)
+    regions = utils.read_regions(args.regions, columns=[])
+    arrays = build_topology(regions.geometry.values, args.quantization)
+    topology.write_topology(args.output, arrays, key, topology.regions_hash(args.regions))
+    n_vertices = shapely.get_num_coordinates(regions.geometry.values).sum()
+    print(f"Wrote {len(arrays['arc_offsets']) - 1} arcs of {len(arrays['arcs'])} vertices, from {n_vertices} vertices, "
+          f"to {args.output.name}")